@@ -0,0 +1,155 @@
+#  This file is part of cappuccino.
+#
+#  cappuccino is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  cappuccino is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with cappuccino.  If not, see <https://www.gnu.org/licenses/>.
+
+import asyncio
+import logging
+import secrets
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from collections.abc import Callable
+
+SERVER_NAME = "irc.bench.local"
+
+log = logging.getLogger(__name__)
+
+
+def _parse_line(line: str) -> tuple[str, list[str]]:
+    if line.startswith(":"):
+        _, _, line = line.partition(" ")
+
+    line, separator, trailing = line.partition(" :")
+    command, *params = line.split()
+    if separator:
+        params.append(trailing)
+
+    return command.upper(), params
+
+
+class FakeIrcServer:
+    """Just enough of an IRC server to register one bot, join it to channels and
+    relay messages both ways."""
+
+    def __init__(self, on_message: Callable[[str, str, str], None]):
+        # Called with (command, target, text) for every PRIVMSG/NOTICE the bot sends.
+        self._on_message = on_message
+        self._server: asyncio.Server | None = None
+        self._writer: asyncio.StreamWriter | None = None
+        self._pongs: dict[str, asyncio.Future] = {}
+        self._joined_changed = asyncio.Event()
+        self.nick: str | None = None
+        self._user_received = False
+        self.joined: set[str] = set()
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> int:
+        self._server = await asyncio.start_server(self._handle_client, host, port)
+        return self._server.sockets[0].getsockname()[1]
+
+    async def close(self):
+        if self._writer is not None:
+            self._writer.close()
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+
+    def send(self, line: str):
+        if self._writer is None:
+            raise ConnectionError("The bot isn't connected.")
+        self._writer.write(f"{line}\r\n".encode())
+
+    async def drain(self):
+        if self._writer is not None:
+            await self._writer.drain()
+
+    def privmsg(self, nick: str, target: str, text: str):
+        self.send(f":{nick}!{nick}@bench.local PRIVMSG {target} :{text}")
+
+    async def ping(self):
+        """Waits until the bot has read and dispatched everything sent so far."""
+        token = secrets.token_hex(8)
+        self._pongs[token] = asyncio.get_running_loop().create_future()
+        self.send(f"PING :{token}")
+        await self._pongs[token]
+
+    async def wait_joined(self, channels: list[str]):
+        wanted = {channel.lower() for channel in channels}
+        while not wanted <= self.joined:
+            self._joined_changed.clear()
+            await self._joined_changed.wait()
+
+    async def _handle_client(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ):
+        if self._writer is not None:
+            writer.close()
+            return
+
+        self._writer = writer
+        try:
+            while line := await reader.readline():
+                self._handle_line(line.decode("UTF-8", errors="replace").rstrip())
+        except ConnectionError:
+            pass
+        finally:
+            self._writer = None
+            writer.close()
+
+    def _welcome(self):
+        self.send(f":{SERVER_NAME} 001 {self.nick} :Welcome to the benchmark.")
+        self.send(
+            f":{SERVER_NAME} 005 {self.nick} CHANTYPES=# PREFIX=(ov)@+"
+            " :are supported by this server"
+        )
+        self.send(f":{SERVER_NAME} 376 {self.nick} :End of /MOTD command.")
+
+    def _join(self, channel: str):
+        mask = f"{self.nick}!{self.nick}@bench.local"
+        self.send(f":{mask} JOIN {channel}")
+        self.send(f":{SERVER_NAME} 353 {self.nick} = {channel} :{self.nick}")
+        self.send(f":{SERVER_NAME} 366 {self.nick} {channel} :End of /NAMES list.")
+        self.joined.add(channel.lower())
+        self._joined_changed.set()
+
+    def _register(self, command: str, params: list[str]):
+        # Clients may send NICK and USER in either order.
+        registered = self.nick is not None and self._user_received
+        if command == "NICK":
+            self.nick = params[0]
+        else:
+            self._user_received = True
+
+        if not registered and self.nick is not None and self._user_received:
+            self._welcome()
+
+    def _handle_line(self, line: str):
+        if not line:
+            return
+
+        command, params = _parse_line(line)
+        match command:
+            case "NICK" | "USER":
+                self._register(command, params)
+            case "PING":
+                self.send(f":{SERVER_NAME} PONG {SERVER_NAME} :{params[-1]}")
+            case "PONG":
+                if future := self._pongs.pop(params[-1], None):
+                    future.set_result(None)
+            case "JOIN":
+                for channel in params[0].split(","):
+                    self._join(channel)
+            case "PRIVMSG" | "NOTICE":
+                self._on_message(command, params[0], params[-1])
+            case _:
+                log.debug(f"Ignoring {line}")
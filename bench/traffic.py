@@ -0,0 +1,189 @@
+#  This file is part of cappuccino.
+#
+#  cappuccino is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  cappuccino is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with cappuccino.  If not, see <https://www.gnu.org/licenses/>.
+
+import random
+import re
+from collections import deque
+from dataclasses import dataclass
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from collections.abc import Iterator
+    from pathlib import Path
+
+# Deliberately free of anything cappuccino.fun reacts to (ayy, same, sup...).
+WORDS = (  # noqa: SIM905
+    "arch bar blur border bright build clean colour compile compositor config"
+    " cool dark desktop emacs floating font gaps gentoo gtk icons kernel launcher"
+    " linux looks manager minimal monitor nice nix notification panel patch"
+    " prompt python really rice rust scheme screenshot script shader terminal"
+    " theme tiling today void vim wallpaper weekend window zsh"
+).split()
+
+TRIGGER_NAMES = [f"bench{index}" for index in range(10)]
+RICE_CATEGORIES = ["dtop", "dotfiles", "station"]
+
+DEFAULT_MIX = {
+    "chatter": 60,
+    "url": 5,
+    "trigger": 10,
+    "sed": 5,
+    "mention": 5,
+    "command": 15,
+}
+
+# Recorded logs in the usual "[12:34] <@nick> message" shape, timestamp optional.
+_LOG_LINE = re.compile(r"^(?:\[[^\]]*\]\s*)?<[~&@%+]?(?P<nick>[^>\s]+)>\s(?P<text>.*)$")
+_SED = re.compile(r"^\s*s[/|\\!.,].+")
+_TRIGGER = re.compile(r"\?([A-Za-z0-9]+)")
+_URL = re.compile(r"https?://", re.IGNORECASE)
+
+
+@dataclass(frozen=True)
+class Message:
+    # What the message exercises, used to group latencies in the report.
+    kind: str
+    nick: str
+    text: str
+    expects_reply: bool
+
+
+def parse_mix(mix: str) -> dict[str, float]:
+    """Parses "chatter=60,url=5,..." into message kind weights."""
+    weights = {}
+    for pair in mix.split(","):
+        kind, _, weight = pair.partition("=")
+        kind = kind.strip()
+        if kind not in DEFAULT_MIX:
+            raise ValueError(f"Unknown message kind {kind!r}.")
+        weights[kind] = float(weight)
+    return weights
+
+
+class TrafficGenerator:
+    """Generates an endless, reproducible stream of channel traffic."""
+
+    def __init__(
+        self,
+        bot_nick: str,
+        cmd_char: str,
+        nicks: list[str],
+        mix: dict[str, float],
+        seed: int | None = None,
+    ):
+        self._bot_nick = bot_nick
+        self._cmd_char = cmd_char
+        self._nicks = nicks
+        self._kinds = list(mix)
+        self._weights = list(mix.values())
+        self._random = random.Random(seed)
+        # Recent lines per channel, so sed commands have something to edit.
+        self._history: dict[str, deque[str]] = {}
+
+    def _sentence(self, min_words: int = 4, max_words: int = 12) -> str:
+        length = self._random.randint(min_words, max_words)
+        return " ".join(self._random.choices(WORDS, k=length))
+
+    def _chatter(self, nick: str, channel: str) -> Message:
+        text = self._sentence()
+        self._history.setdefault(channel, deque(maxlen=20)).append(text)
+        return Message("chatter", nick, text, expects_reply=False)
+
+    def _url(self, nick: str) -> Message:
+        # Loopback URLs are rejected before any request is made, so this only
+        # measures UrlInfo's own overhead and never touches the network.
+        word = self._random.choice(WORDS)
+        text = f"{self._sentence(1, 4)} http://127.0.0.1/{word}/{self._random.randrange(1000)}"
+        return Message("url", nick, text, expects_reply=False)
+
+    def _trigger(self, nick: str) -> Message:
+        text = f"{self._sentence(1, 3)} ?{self._random.choice(TRIGGER_NAMES)}"
+        return Message("trigger", nick, text, expects_reply=True)
+
+    def _sed(self, nick: str, channel: str) -> Message:
+        history = self._history.get(channel)
+        if not history:
+            return self._chatter(nick, channel)
+
+        word = self._random.choice(self._random.choice(history).split())
+        return Message("sed", nick, f"s/{word}/{word.upper()}/", expects_reply=True)
+
+    def _mention(self, nick: str) -> Message:
+        text = f"{self._bot_nick}: {self._sentence()}"
+        return Message("mention", nick, text, expects_reply=True)
+
+    def _command(self, nick: str) -> Message:
+        other = self._random.choice(self._nicks)
+        commands = {
+            "ping": "ping",
+            "seen": f"seen {other}",
+            "8ball": f"8ball {self._sentence(2, 6)}?",
+            "decide": f"decide {self._random.choice(WORDS)} or {self._random.choice(WORDS)}",
+            "rice": f"{self._random.choice(RICE_CATEGORIES)} {other}",
+        }
+        name, command = self._random.choice(list(commands.items()))
+        return Message(
+            f"command:{name}", nick, f"{self._cmd_char}{command}", expects_reply=True
+        )
+
+    def message(self, channel: str) -> Message:
+        nick = self._random.choice(self._nicks)
+        match self._random.choices(self._kinds, self._weights)[0]:
+            case "url":
+                return self._url(nick)
+            case "trigger":
+                return self._trigger(nick)
+            case "sed":
+                return self._sed(nick, channel)
+            case "mention":
+                return self._mention(nick)
+            case "command":
+                return self._command(nick)
+            case _:
+                return self._chatter(nick, channel)
+
+
+def classify(text: str, bot_nick: str, cmd_char: str) -> tuple[str, bool]:
+    """Guesses the kind of a recorded line and whether the bot should answer it."""
+    if text.startswith(cmd_char) and len(text) > len(cmd_char):
+        name = text.removeprefix(cmd_char).split(maxsplit=1)[0].lower()
+        return f"command:{name}", True
+    if _SED.match(text):
+        return "sed", True
+    if bot_nick.lower() in text.lower():
+        return "mention", True
+    if _URL.search(text):
+        return "url", False
+    if match := _TRIGGER.search(text):
+        return "trigger", match.group(1) in TRIGGER_NAMES
+    return "chatter", False
+
+
+def load_recorded(path: Path, bot_nick: str, cmd_char: str) -> list[Message]:
+    """Loads "<nick> message" lines from a chat log, skipping anything else."""
+    messages = []
+    with path.open(encoding="UTF-8", errors="replace") as log:
+        for line in log:
+            if match := _LOG_LINE.match(line.rstrip("\r\n")):
+                kind, expects_reply = classify(match["text"], bot_nick, cmd_char)
+                messages.append(
+                    Message(kind, match["nick"], match["text"], expects_reply)
+                )
+    return messages
+
+
+def replay_recorded(messages: list[Message]) -> Iterator[Message]:
+    while True:
+        yield from messages
@@ -13,59 +13,47 @@
 #  You should have received a copy of the GNU General Public License
 #  along with cappuccino.  If not, see <https://www.gnu.org/licenses/>.
 
+import contextlib
 import logging
-import os
-from secrets import randbelow
+import signal
 from typing import TYPE_CHECKING
 
-import requests
-from requests import Session
-from requests.cookies import RequestsCookieJar
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
-
-from cappuccino.util import meta
+from cappuccino.util.database import get_database
+from cappuccino.util.dispatch import install_event_prefilter
+from cappuccino.util.executor import get_executor
+from cappuccino.util.http import get_http_client
 
 if TYPE_CHECKING:
     from irc3 import IrcBot
 
 
-def _create_requests_session() -> Session:
-    requests.packages.urllib3.disable_warnings()
-
-    # Accept YouTube consent cookies automatically
-    cookie_jar = RequestsCookieJar()
-    cookie_value = f"YES+srp.gws-20210512-0-RC3.en+FX+{1 + randbelow(1000)}"
-    cookie_jar.set("CONSENT", cookie_value)
-
-    session = Session()
-    session.cookies = cookie_jar
-    session.headers.update(
-        {
-            "User-Agent": f"cappuccino {meta.VERSION} - {meta.SOURCE}",
-            "Accept-Language": "en-GB,en-US,en;q=0.5",
-            "timeout": "5",
-            "allow_redirects": "true",
-        }
-    )
-    return session
-
-
 class Plugin:
     def __init__(self, bot: IrcBot):
         plugin_module = self.__class__.__module__
         self.bot = bot
         self.config: dict = self.bot.config.get(plugin_module, {})
         self.logger = logging.getLogger(f"irc3.{plugin_module}")
-        self.requests = _create_requests_session()
+        # Don't try every event regex on lines they can't possibly match.
+        install_event_prefilter(self.bot.registry)
+        # One pooled HTTP/2 client is shared by every plugin.
+        self.http = get_http_client(self.bot.config.get("http", {}), self.bot.loop)
 
-        db_config = self.bot.config.get("database", {})
-        db = create_engine(
-            db_config.get("uri"),
-            pool_size=db_config.get("pool_size", os.cpu_count()),
-            max_overflow=db_config.get("max_overflow", os.cpu_count()),
+        # Every plugin shares one engine and connection budget per database.
+        self.db = get_database(self.bot.config.get("database", {}))
+        db_max_connections = self.config.get("db_max_connections")
+        db_max_connections = int(db_max_connections) if db_max_connections else None
+        self.db_session = self.db.session_factory(plugin_module, db_max_connections)
+        # Prefer this in event handlers and commands, it doesn't block the loop.
+        self.async_db_session = self.db.async_session_factory(
+            plugin_module, db_max_connections
+        )
+
+        # Blocking work goes through a shared thread pool, see run_blocking().
+        self.executor = get_executor(self.bot.config.get("executor", {}))
+        max_workers = self.config.get("executor_max_workers")
+        self._blocking_quota = self.executor.quota(
+            plugin_module, int(max_workers) if max_workers else None
         )
-        self.db_session = sessionmaker(db)
 
         if self.config:
             # I have no idea where these are coming from but whatever.
@@ -75,3 +63,20 @@ class Plugin:
                     self.config.pop(key)
 
             self.logger.debug(f"Configuration for {plugin_module}: {self.config}")
+
+    def stop_on_sigterm(self):
+        """Makes SIGTERM stop the bot the way SIGINT does, running SIGINT hooks.
+
+        irc3 only handles SIGINT and SIGHUP, but SIGTERM is what docker stop and
+        systemd send, and without a handler it kills the bot on the spot.
+        """
+        with contextlib.suppress(NotImplementedError, RuntimeError):
+            self.bot.loop.add_signal_handler(signal.SIGTERM, self.bot.SIGINT)
+
+    async def run_blocking(self, func, /, *args, **kwargs):
+        """Run a blocking function in the bot's thread pool and wait for the result.
+
+        Counts against this plugin's share of the pool, so it will wait if the
+        plugin already has too much running.
+        """
+        return await self._blocking_quota.run(func, *args, **kwargs)
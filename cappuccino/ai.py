@@ -13,39 +13,155 @@
 #  You should have received a copy of the GNU General Public License
 #  along with cappuccino.  If not, see <https://www.gnu.org/licenses/>.
 
-import contextlib
+import asyncio
+import math
+import os
 import random
-import re
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from datetime import UTC, datetime
+from pathlib import Path
 from timeit import default_timer as timer
+from typing import TYPE_CHECKING
+from urllib.parse import quote
 
 import irc3
-import markovify
 from humanize import intcomma, precisedelta
 from irc3.plugins.command import command
 from irc3.utils import IrcString
-from sqlalchemy import func, select, update
-from sqlalchemy.exc import IntegrityError
+from sqlalchemy import (
+    BigInteger,
+    Text,
+    cast,
+    column,
+    exists,
+    func,
+    select,
+    true,
+    union_all,
+    update,
+    values,
+)
+from sqlalchemy.dialects.postgresql import insert
 
 from cappuccino import Plugin
 from cappuccino.db.models.ai import AIChannel, CorpusLine
+from cappuccino.util.cache import MISSING, LRUCache
 from cappuccino.util.channel import is_chanop
-from cappuccino.util.formatting import unstyle
+from cappuccino.util.message import Message, message_event
 
-_CMD_PATTERN = re.compile(r"^\s*([.!~`$])+")
-_SED_CHECKER = re.compile(r"^\s*s[/|\\!.,].+")
-_URL_CHECKER = re.compile(r".*https?://.*", re.IGNORECASE | re.UNICODE)
+if TYPE_CHECKING:
+    from cappuccino.util.markov import OnlineText
 
+_DEFAULT_MODEL_CACHE_DIR = (
+    Path(os.getenv("XDG_CACHE_HOME") or Path.home() / ".cache") / "cappuccino" / "ai"
+)
+# Sampling picks this many times more ids than it needs lines, to make up for
+# the duplicate picks it drops. Ranges of fewer than twice as many ids as lines
+# are shuffled whole instead, as there'd be too many duplicates.
+_OVERSAMPLING = 1.5
 
-def _should_ignore_message(line):
-    if not line:
-        return None
 
+def _should_ignore_message(message: Message) -> bool:
+    if not message.stripped:
+        return True
+
+    return (
+        message.looks_like_command
+        or message.is_sed
+        or message.is_action
+        or bool(message.urls)
+        or message.stripped.startswith("[")
+    )
+
+
+def _corpus_lines(channel: str | None, *columns):
+    statement = select(*columns)
+    if channel:
+        statement = statement.where(
+            func.lower(CorpusLine.channel_name) == channel.lower()
+        )
+    return statement
+
+
+def _sample_lines(channel: str | None, count: int, first_id: int, last_id: int):
+    """Picks random ids between first_id and last_id, and takes the line with each
+    one or the next one after it, up to count lines.
+
+    Every pick is one index lookup, however big the corpus is. Lines after gaps in
+    the ids are a little likelier to be picked, and duplicate picks are dropped.
+    """
+    picks = (
+        select(
+            cast(
+                first_id + func.floor(func.random() * (last_id - first_id + 1)),
+                BigInteger,
+            ).label("id")
+        )
+        .select_from(func.generate_series(1, math.ceil(count * _OVERSAMPLING)))
+        .subquery("picks")
+    )
+    picked = (
+        _corpus_lines(channel, CorpusLine.line)
+        .where(CorpusLine.id >= picks.c.id)
+        .order_by(CorpusLine.id)
+        .limit(1)
+        .lateral("picked")
+    )
     return (
-        _CMD_PATTERN.match(line)
-        or _SED_CHECKER.match(line)
-        or _URL_CHECKER.match(line)
-        or line.startswith(("[", "\x01ACTION "))
+        select(picked.c.line)
+        .select_from(picks)
+        .join(picked, true())
+        .distinct()
+        .limit(count)
+    )
+
+
+def _insert_lines(batch: list[tuple[str, str]]):
+    """Adds (line, channel) pairs to the corpus, and any channels it doesn't have.
+
+    Returns the lines which weren't already in it, and their channels.
+    """
+    # Channels are matched case-insensitively, so only add the ones with no row
+    # in any case, and add lines to whichever row they already have.
+    channel_names = {channel.lower(): channel for _, channel in batch}
+    channels = values(column("name", Text), name="channels").data(
+        [(name,) for name in channel_names.values()]
+    )
+    new_channels = (
+        insert(AIChannel)
+        .from_select(
+            ["name"],
+            select(channels.c.name).where(
+                ~exists().where(
+                    func.lower(AIChannel.name) == func.lower(channels.c.name)
+                )
+            ),
+        )
+        .on_conflict_do_nothing()
+        .returning(AIChannel.name)
+        .cte("new_channels")
+    )
+    known_channels = union_all(
+        select(AIChannel.name).where(
+            func.lower(AIChannel.name).in_(list(channel_names))
+        ),
+        select(new_channels.c.name),
+    ).subquery("known_channels")
+
+    pending = values(
+        column("line", Text), column("channel", Text), name="pending"
+    ).data(batch)
+    rows = select(pending.c.line, known_channels.c.name).join(
+        known_channels,
+        func.lower(known_channels.c.name) == func.lower(pending.c.channel),
+    )
+    return (
+        insert(CorpusLine)
+        .from_select(["line", "channel_name"], rows)
+        .on_conflict_do_nothing()
+        .returning(CorpusLine.line, CorpusLine.channel_name)
+        .add_cte(new_channels)
     )
 
 
@@ -58,61 +174,305 @@ class Ai(Plugin):
         self._ignore_nicks: list[str] = self.config.get("ignore_nicks", [])
         self._max_loaded_lines: int = self.config.get("max_loaded_lines", 25000)
         self._max_reply_length: int = self.config.get("max_reply_length", 100)
-        self._text_model = self._create_text_model()
+        # Models are saved here, and loaded at startup instead of being rebuilt
+        # unless more than model_rebuild_after lines have been added since.
+        model_cache_dir = self.config.get("model_cache_dir", _DEFAULT_MODEL_CACHE_DIR)
+        self._model_cache_dir = Path(model_cache_dir) if model_cache_dir else None
+        self._model_rebuild_after = int(self.config.get("model_rebuild_after", 5000))
+        # Building a chain is all CPU, so models are built one at a time in a
+        # worker process rather than competing with the event loop for the GIL.
+        self._build_pool = ProcessPoolExecutor(max_workers=1)
+        # Built in the background so it doesn't hold up connecting.
+        self._text_model = None
+        self.bot.create_task(self._load_text_model())
+
+        # Optionally, each channel also gets a model of its own. They're built
+        # the first time the bot is mentioned there and dropped again once they
+        # haven't learned anything for channel_model_ttl seconds, or to keep the
+        # lines loaded into all of them under channel_models_budget.
+        self._channel_models_enabled: bool = self.config.get("channel_models", False)
+        self._max_channel_lines = int(self.config.get("max_channel_lines", 5000))
+        # The chance of replying from the global model anyway.
+        self._global_model_weight = float(self.config.get("global_model_weight", 0))
+        # Lowercased channel -> its model.
+        self._channel_models = LRUCache(
+            f"{__name__}.channel_models",
+            int(self.config.get("channel_models_budget", 50000)),
+            float(self.config.get("channel_model_ttl", 3600)),
+            weigh=lambda model: max(len(model), 1),
+        )
+        # Lowercased channels whose models are being built.
+        self._building_channels: set[str] = set()
+
+        # New lines are kept in memory and added to the corpus in batches.
+        self._flush_interval = float(self.config.get("flush_interval", 10))
+        self._max_batch_size = int(self.config.get("max_batch_size", 500))
+        # Any more are dropped until the database catches up.
+        self._max_pending_lines = int(self.config.get("max_pending_lines", 5000))
+        # Line -> its channel, for everything not yet written.
+        self._pending_lines: dict[str, str] = {}
+        self._flush_lock = asyncio.Lock()
+        self.bot.create_task(self._flush_periodically())
+        # So that stopping the container saves those and stops any build too.
+        self.stop_on_sigterm()
+
+    def SIGINT(self):  # noqa: N802
+        self._build_pool.shutdown(wait=False, cancel_futures=True)
+
+        # The loop stops straight after this, so write whatever's left now.
+        pending, self._pending_lines = self._pending_lines, {}
+        if not pending:
+            return
+
+        try:
+            with self.db_session.begin() as session:
+                for batch in self._batches(pending):
+                    session.execute(_insert_lines(batch))
+        except Exception:
+            self.logger.exception(f"Couldn't save {len(pending)} corpus lines.")
+
+    async def _load_text_model(self):
+        try:
+            text_model, version = await self._create_text_model(
+                None, self._max_loaded_lines
+            )
+            async with self._flush_lock:
+                await self._catch_up(text_model, None, version)
+                self._text_model = text_model
+        except Exception:
+            self.logger.exception("Couldn't create text model.")
+
+    async def _load_channel_model(self, channel: str):
+        key = channel.lower()
+        self._building_channels.add(key)
+        try:
+            text_model, version = await self._create_text_model(
+                channel, self._max_channel_lines
+            )
+            async with self._flush_lock:
+                await self._catch_up(text_model, channel, version)
+                self._channel_models.set(key, text_model)
+        except Exception:
+            self.logger.exception(f"Couldn't create text model for {channel}.")
+        finally:
+            self._building_channels.discard(key)
+
+    async def _catch_up(
+        self, text_model: OnlineText, channel: str | None, version: int
+    ):
+        """Teaches a new model the lines added to the corpus since version.
+
+        Call it holding _flush_lock and put the model in place before letting go,
+        so every line is learned once, either here or as it's flushed.
+        """
+        _, lines = await self.run_blocking(
+            self._get_lines_after, channel, version, text_model.max_lines
+        )
+        for line in lines:
+            text_model.add_line(line)
+
+    def _model_cache_path(self, channel: str | None) -> Path | None:
+        if self._model_cache_dir is None:
+            return None
+        name = quote(channel.lower(), safe="") if channel else "global"
+        return self._model_cache_dir / f"{name}.json"
+
+    async def _create_text_model(
+        self, channel: str | None, max_lines: int
+    ) -> tuple[OnlineText, int]:
+        """Loads channel's saved model, or builds one in a worker process.
+
+        Returns it and the corpus version it's learned up to. New lines are added
+        to it as they're seen, and the oldest dropped, so it never needs
+        rebuilding while the bot is running.
+        """
+        from cappuccino.util.markov import build_text_model  # noqa: PLC0415
+
+        path = self._model_cache_path(channel)
+        saved = await self.run_blocking(
+            self._load_saved_model, channel, max_lines, path
+        )
+        if saved is not None:
+            return saved
 
-    def _create_text_model(self):
-        self.logger.info("Creating text model...")
+        self.logger.info(f"Creating text model for {channel or 'every channel'}...")
         start = datetime.now(UTC)
-        corpus = self._get_lines()
+        version, corpus = await self.run_blocking(self._get_lines, channel, max_lines)
         end = datetime.now(UTC)
 
         if not corpus:
             self.logger.warning(
                 "Not enough lines in corpus for markovify to generate a decent reply."
             )
-            return None
 
         self.logger.debug(f"Queried {len(corpus)} rows in {precisedelta(end - start)}.")
 
         start = datetime.now(UTC)
-        model = markovify.NewlineText(
-            "\n".join(corpus), retain_original=False
-        ).compile()
+        try:
+            model, save_error = await asyncio.get_running_loop().run_in_executor(
+                self._build_pool, build_text_model, corpus, max_lines, path, version
+            )
+        except BrokenProcessPool:
+            # The worker died, most likely killed for its memory use, and the
+            # pool can't be used again.
+            self._build_pool = ProcessPoolExecutor(max_workers=1)
+            raise
         end = datetime.now(UTC)
-        self.logger.info(f"Created text model in {precisedelta(start - end)}.")
+        self.logger.info(f"Created text model in {precisedelta(end - start)}.")
+
+        if save_error is not None:
+            self.logger.warning(f"Couldn't save text model to {path}: {save_error}")
+        return model, version
+
+    def _load_saved_model(
+        self, channel: str | None, max_lines: int, path: Path | None
+    ) -> tuple[OnlineText, int] | None:
+        from cappuccino.util.markov import load_text_model  # noqa: PLC0415
+
+        if path is None or not path.exists():
+            return None
+
+        try:
+            model, version = load_text_model(path)
+        except (OSError, ValueError, KeyError, TypeError):
+            self.logger.warning(f"Couldn't load text model from {path}, rebuilding it.")
+            return None
+        if model.max_lines != max_lines:
+            return None
+
+        # One more than we'd catch up on, to tell if there are too many.
+        new_version, new_lines = self._get_lines_after(
+            channel, version, self._model_rebuild_after + 1
+        )
+        if len(new_lines) > self._model_rebuild_after:
+            return None
 
-        return model
+        for line in new_lines:
+            model.add_line(line)
+        self.logger.info(
+            f"Loaded text model for {channel or 'every channel'} from {path},"
+            f" with {len(new_lines)} new lines."
+        )
+        return model, new_version
+
+    def _learn_line(self, line: str, channel: str):
+        # Models still being built catch up on these from the corpus instead.
+        if self._text_model is not None:
+            self._text_model.add_line(line)
+
+        key = channel.lower()
+        if (text_model := self._channel_models.peek(key)) is not MISSING:
+            text_model.add_line(line)
+            # Weighed again now that it's bigger, and kept loaded while it's busy.
+            self._channel_models.set(key, text_model)
+
+    def _reply_model(self, channel: str):
+        """The model to reply to a mention in channel with, if there is one yet."""
+        if not self._channel_models_enabled:
+            return self._text_model
+
+        self._channel_models.expire()
+        text_model = self._channel_models.get(channel.lower())
+        if text_model is MISSING:
+            if channel.lower() not in self._building_channels:
+                self.bot.create_task(self._load_channel_model(channel))
+            return self._text_model
+
+        if random.random() < self._global_model_weight:  # noqa: S311
+            return self._text_model or text_model
+        return text_model
 
     def _add_line(self, line: str, channel: str):
-        line = unstyle(line)
-        with (
-            contextlib.suppress(IntegrityError),
-            self.db_session() as session,
-        ):
-            ai_channel = session.scalar(
-                select(AIChannel).where(func.lower(AIChannel.name) == channel.lower())
-            )
-            if not ai_channel:
-                ai_channel = AIChannel(name=channel)
+        if line in self._pending_lines:
+            return
+        if len(self._pending_lines) >= self._max_pending_lines:
+            self.logger.debug(f"Too many lines waiting to be saved, dropping {line!r}.")
+            return
 
-            corpus_line = CorpusLine(line=line)
-            ai_channel.lines.append(corpus_line)
-            session.add_all([ai_channel, corpus_line])
+        self._pending_lines[line] = channel
+        if (
+            len(self._pending_lines) >= self._max_batch_size
+            and not self._flush_lock.locked()
+        ):
+            self.bot.create_task(self._flush())
+
+    def _batches(self, pending: dict[str, str]):
+        rows = list(pending.items())
+        for start in range(0, len(rows), self._max_batch_size):
+            yield rows[start : start + self._max_batch_size]
+
+    async def _flush_periodically(self):
+        while True:
+            await asyncio.sleep(self._flush_interval)
+            await self._flush()
+
+    async def _flush(self):
+        async with self._flush_lock:
+            if not self._pending_lines:
+                return
+
+            pending, self._pending_lines = self._pending_lines, {}
+            added = []
+            try:
+                async with self.async_db_session.begin() as session:
+                    for batch in self._batches(pending):
+                        result = await session.execute(_insert_lines(batch))
+                        added.extend(result.all())
+            except Exception:
+                self.logger.exception(f"Couldn't save {len(pending)} corpus lines.")
+                # Try again next time, if there's room.
+                room = max(self._max_pending_lines - len(self._pending_lines), 0)
+                self._pending_lines = (
+                    dict(list(pending.items())[:room]) | self._pending_lines
+                )
+                return
 
-    def _get_lines(self, channel: str | None = None) -> list[str]:
-        select_stmt = select(CorpusLine.line)
-        if channel:
-            select_stmt = select(AIChannel.lines).where(
-                func.lower(AIChannel.name) == channel.lower()
-            )
-        select_stmt = select_stmt.order_by(func.random()).limit(self._max_loaded_lines)
+            # Lines already in the corpus aren't learned twice.
+            for line, channel in added:
+                self._learn_line(line, channel)
 
+    def _get_lines(self, channel: str | None, max_lines: int) -> tuple[int, list[str]]:
+        """Returns a sample of the corpus, and the corpus version it was taken from."""
         with self.db_session() as session:
+            first_id, last_id = session.execute(
+                _corpus_lines(channel, func.min(CorpusLine.id), func.max(CorpusLine.id))
+            ).one()
+            if first_id is None:
+                return 0, []
+
+            if last_id - first_id < max_lines * 2:
+                # Few enough to shuffle them all, and take all of them if there
+                # aren't more than we want.
+                select_stmt = (
+                    _corpus_lines(channel, CorpusLine.line)
+                    .where(CorpusLine.id.between(first_id, last_id))
+                    .order_by(func.random())
+                    .limit(max_lines)
+                )
+            else:
+                select_stmt = _sample_lines(channel, max_lines, first_id, last_id)
             lines = session.scalars(select_stmt).all()
 
-        return lines if len(lines) > 0 else None
+        return last_id, list(lines)
 
-    def _line_count(self, channel: str | None = None) -> int:
+    def _get_lines_after(
+        self, channel: str | None, version: int, limit: int
+    ) -> tuple[int, list[str]]:
+        """The lines added to the corpus since version, oldest first, and the
+        version they go up to.
+        """
+        with self.db_session() as session:
+            rows = session.execute(
+                _corpus_lines(channel, CorpusLine.id, CorpusLine.line)
+                .where(CorpusLine.id > version)
+                .order_by(CorpusLine.id)
+                .limit(limit)
+            ).all()
+        if not rows:
+            return version, []
+        return rows[-1].id, [row.line for row in rows]
+
+    async def _line_count(self, channel: str | None = None) -> int:
         select_stmt = select(func.count()).select_from(CorpusLine)
         if channel:
             select_stmt = select_stmt.where(
@@ -120,37 +480,36 @@ class Ai(Plugin):
             )
             self.logger.debug(select_stmt)
 
-        with self.db_session() as session:
-            return session.scalar(select_stmt)
+        async with self.async_db_session() as session:
+            return await session.scalar(select_stmt)
 
-    def _is_enabled_for_channel(self, channel: str) -> bool:
+    async def _is_enabled_for_channel(self, channel: str) -> bool:
         if not IrcString(channel).is_channel:
             return False
 
-        with self.db_session() as session:
-            return session.scalar(
+        async with self.async_db_session() as session:
+            return await session.scalar(
                 select(AIChannel.enabled).where(
                     func.lower(AIChannel.name) == channel.lower()
                 )
             )
 
-    def _toggle(self, channel: str):
-        new_status = not self._is_enabled_for_channel(channel)
+    async def _toggle(self, channel: str):
+        new_status = not await self._is_enabled_for_channel(channel)
 
-        with self.db_session() as session:
-            ai_channel = session.scalar(
+        async with self.async_db_session.begin() as session:
+            channel_name = await session.scalar(
                 update(AIChannel)
-                .returning(AIChannel)
+                .returning(AIChannel.name)
                 .where(func.lower(AIChannel.name) == channel.lower())
                 .values(enabled=new_status)
             )
 
-            if ai_channel is None:
-                ai_channel = AIChannel(name=channel, enabled=new_status)
-                session.add(ai_channel)
+            if channel_name is None:
+                session.add(AIChannel(name=channel, enabled=new_status))
 
     @command()
-    def ai(self, mask, target, args):
+    async def ai(self, mask, target, args):
         """Toggles chattiness.
 
         %%ai [--status]
@@ -160,8 +519,8 @@ class Ai(Plugin):
             return "This command cannot be used in PM."
 
         if args["--status"]:
-            line_count = self._line_count()
-            channel_line_count = self._line_count(target)
+            line_count = await self._line_count()
+            channel_line_count = await self._line_count(target)
             channel_percentage = 0
 
             # Percentage of global lines the current channel accounts for.
@@ -173,7 +532,7 @@ class Ai(Plugin):
                 )
 
             ai_status = (
-                "enabled" if self._is_enabled_for_channel(target) else "disabled"
+                "enabled" if await self._is_enabled_for_channel(target) else "disabled"
             )
             line_counts = f"{intcomma(channel_line_count)}/{intcomma(line_count)}"
             return (
@@ -191,48 +550,55 @@ class Ai(Plugin):
 
             return f"You must be a channel operator ({op_prefixes}) to do that."
 
-        self._toggle(target)
+        await self._toggle(target)
         return (
             "Chatbot activated."
-            if self._is_enabled_for_channel(target)
+            if await self._is_enabled_for_channel(target)
             else "Shutting up!"
         )
 
-    @irc3.event(irc3.rfc.PRIVMSG)
-    def handle_line(self, target, event, mask, data):
+    @message_event()
+    async def handle_line(self, message: Message):
+        target, mask = message.target, message.mask
         if not target.is_channel or not mask.is_user:
             return
 
         if mask.nick in self._ignore_nicks or mask.nick == self.bot.nick:
             return
 
-        data = data.strip()
-        if _should_ignore_message(data):
+        if _should_ignore_message(message):
             return
 
         # Only respond to messages mentioning the bot in an active channel
-        if self.bot.nick.lower() not in data.lower():
+        if not message.mentions(self.bot.nick):
             # Only add lines that aren't mentioning the bot
-            self._add_line(data, target)
+            self._add_line(message.unstyled, target)
             return
 
-        if not self._is_enabled_for_channel(target):
+        if not await self._is_enabled_for_channel(target):
             return
 
+        self.bot.privmsg(target, self._generate_reply(target))
+
+    def _generate_reply(self, channel: str) -> str:
+        text_model = self._reply_model(channel)
+        if text_model is None:
+            return "Still warming up, ask me again in a bit."
+
         start = timer()
-        generated_reply = self._text_model.make_short_sentence(self._max_reply_length)
+        generated_reply = text_model.make_short_sentence(self._max_reply_length)
+        if not generated_reply and self._text_model not in (None, text_model):
+            # Too little to go on in this channel yet.
+            generated_reply = self._text_model.make_short_sentence(
+                self._max_reply_length
+            )
         end = timer()
         self.logger.debug(
             f"Generating sentence took {(end - start) * 1000} milliseconds."
         )
 
         if not generated_reply:
-            self.bot.privmsg(
-                target,
-                random.choice(  # noqa: S311
-                    ["What?", "Hmm?", "Yes?", "What do you want?"]
-                ),
+            return random.choice(  # noqa: S311
+                ["What?", "Hmm?", "Yes?", "What do you want?"]
             )
-            return
-
-        self.bot.privmsg(target, generated_reply.strip())
+        return generated_reply.strip()
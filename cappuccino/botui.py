@@ -110,6 +110,45 @@ class BotUI(Plugin):
             self.bot.privmsg(channel, f"[PSA] {message}")
         self.logger.info(f"Sent PSA requested by {mask}: {message}")
 
+    @command(permission="admin", show_in_help_list=False)
+    def dbstats(self, mask, target, args):
+        """Show database connection pool statistics.
+
+        %%dbstats
+        """
+
+        for engine, stats in self.db.stats().items():
+            plugins = ", ".join(
+                f"{name.removeprefix('cappuccino.')}={checked_out}"
+                for name, checked_out in sorted(stats.plugins.items())
+                if checked_out
+            )
+            yield (
+                f"[{engine}] Connections: {stats.checked_out}/{stats.max_connections}"
+                f" (pool {stats.size}, overflow {stats.overflow})."
+                f" Checkouts: {stats.checkouts},"
+                f" wait avg/max: {stats.wait_time_avg * 1000:.1f}/{stats.wait_time_max * 1000:.1f}ms."
+                f" Held by plugins: {plugins or 'none'}."
+            )
+
+    @command(permission="admin", show_in_help_list=False)
+    def execstats(self, mask, target, args):
+        """Show thread pool statistics for blocking plugin work.
+
+        %%execstats
+        """
+
+        stats = self.executor.stats()
+        yield f"Workers: {stats.max_workers}. Queued: {stats.queue_depth}."
+        for name, quota in sorted(stats.plugins.items()):
+            yield (
+                f"[{name.removeprefix('cappuccino.')}]"
+                f" Running: {quota.running}/{quota.limit}."
+                f" Queued: {quota.queued}, waiting: {quota.waiting}."
+                f" Completed: {quota.completed},"
+                f" wait avg/max: {quota.wait_time_avg * 1000:.1f}/{quota.wait_time_max * 1000:.1f}ms."
+            )
+
     @command(permission="view")
     def ping(self, mask, target, args):
         """Ping!
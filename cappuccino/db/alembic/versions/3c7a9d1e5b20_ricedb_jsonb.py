@@ -0,0 +1,54 @@
+"""ricedb lists to jsonb
+
+Revision ID: 3c7a9d1e5b20
+Revises: 8f3b2e6d1c54
+Create Date: 2026-10-18 18:02:37.551903
+
+"""
+
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "3c7a9d1e5b20"
+down_revision = "8f3b2e6d1c54"
+branch_labels = None
+depends_on = None
+
+COLUMNS = [
+    "dtops",
+    "homescreens",
+    "stations",
+    "pets",
+    "dotfiles",
+    "handwritings",
+    "distros",
+    "websites",
+    "selfies",
+]
+
+
+def upgrade():
+    for column in COLUMNS:
+        op.alter_column(
+            "ricedb",
+            column,
+            type_=postgresql.JSONB(),
+            existing_type=sa.JSON(),
+            existing_nullable=True,
+            postgresql_using=f"{column}::jsonb",
+        )
+
+
+def downgrade():
+    for column in COLUMNS:
+        op.alter_column(
+            "ricedb",
+            column,
+            type_=sa.JSON(),
+            existing_type=postgresql.JSONB(),
+            existing_nullable=True,
+            postgresql_using=f"{column}::json",
+        )
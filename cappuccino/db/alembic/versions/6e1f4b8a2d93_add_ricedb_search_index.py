@@ -0,0 +1,48 @@
+"""add ricedb search index
+
+Revision ID: 6e1f4b8a2d93
+Revises: 3c7a9d1e5b20
+Create Date: 2026-10-18 19:15:52.908133
+
+"""
+
+import sqlalchemy as sa
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "6e1f4b8a2d93"
+down_revision = "3c7a9d1e5b20"
+branch_labels = None
+depends_on = None
+
+COLUMNS = [
+    "dtops",
+    "homescreens",
+    "stations",
+    "pets",
+    "dotfiles",
+    "handwritings",
+    "distros",
+    "websites",
+    "selfies",
+]
+
+
+def upgrade():
+    op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    search_text = " || ".join(
+        f"coalesce(CAST({column} AS TEXT), '')" for column in COLUMNS
+    )
+    op.create_index(
+        "ix_ricedb_search_text",
+        "ricedb",
+        [sa.text(f"lower({search_text}) gin_trgm_ops")],
+        unique=False,
+        postgresql_using="gin",
+    )
+
+
+def downgrade():
+    # pg_trgm is left installed, something else may be using it.
+    op.drop_index("ix_ricedb_search_text", table_name="ricedb")
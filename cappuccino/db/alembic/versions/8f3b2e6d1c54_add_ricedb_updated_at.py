@@ -0,0 +1,37 @@
+"""add ricedb.updated_at
+
+Revision ID: 8f3b2e6d1c54
+Revises: d41c8e5f2a97
+Create Date: 2026-10-18 16:41:08.204719
+
+"""
+
+import sqlalchemy as sa
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "8f3b2e6d1c54"
+down_revision = "d41c8e5f2a97"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column(
+        "ricedb",
+        sa.Column(
+            "updated_at",
+            sa.DateTime(timezone=True),
+            server_default=sa.text("now()"),
+            nullable=False,
+        ),
+    )
+    op.create_index(
+        "ix_ricedb_updated_at_nick", "ricedb", ["updated_at", "nick"], unique=False
+    )
+
+
+def downgrade():
+    op.drop_index("ix_ricedb_updated_at_nick", table_name="ricedb")
+    op.drop_column("ricedb", "updated_at")
@@ -0,0 +1,41 @@
+"""add ai_corpus.id
+
+Revision ID: a52d7c9e3f18
+Revises: 6e1f4b8a2d93
+Create Date: 2026-10-18 20:31:06.417252
+
+"""
+
+import sqlalchemy as sa
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "a52d7c9e3f18"
+down_revision = "6e1f4b8a2d93"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Existing lines are numbered in whatever order they're stored in.
+    op.add_column(
+        "ai_corpus",
+        sa.Column("id", sa.BigInteger(), sa.Identity(), nullable=False),
+    )
+    op.create_index("ix_ai_corpus_id", "ai_corpus", ["id"], unique=True)
+    op.create_index(
+        "ix_ai_corpus_lower_channel_name_id",
+        "ai_corpus",
+        [sa.text("lower(channel_name)"), "id"],
+    )
+    op.drop_index("ix_ai_corpus_lower_channel_name", table_name="ai_corpus")
+
+
+def downgrade():
+    op.create_index(
+        "ix_ai_corpus_lower_channel_name", "ai_corpus", [sa.text("lower(channel_name)")]
+    )
+    op.drop_index("ix_ai_corpus_lower_channel_name_id", table_name="ai_corpus")
+    op.drop_index("ix_ai_corpus_id", table_name="ai_corpus")
+    op.drop_column("ai_corpus", "id")
@@ -12,7 +12,6 @@ import sqlalchemy as sa
 from sqlalchemy import select, update
 
 from alembic import op
-from cappuccino.userdb import RiceDB
 
 # revision identifiers, used by Alembic.
 revision = "c7308e3c814a"
@@ -40,11 +39,27 @@ def upgrade():
 
 
 def copy_json_to_columns():
-    ricedb_table = RiceDB.__table__
+    # The table as it is at this revision, not as the models describe it now.
+    ricedb_table = sa.table(
+        table,
+        sa.column("nick", sa.String()),
+        sa.column("data", sa.JSON()),
+        sa.column("dtops", sa.JSON()),
+        sa.column("homescreens", sa.JSON()),
+        sa.column("stations", sa.JSON()),
+        sa.column("pets", sa.JSON()),
+        sa.column("dotfiles", sa.JSON()),
+        sa.column("handwritings", sa.JSON()),
+        sa.column("distros", sa.JSON()),
+        sa.column("websites", sa.JSON()),
+        sa.column("selfies", sa.JSON()),
+        sa.column("lastfm", sa.String()),
+        sa.column("last_seen", sa.DateTime()),
+    )
     conn = op.get_bind()
-    for result in conn.execute(select(ricedb_table)):
+    for result in conn.execute(select(ricedb_table.c.nick, ricedb_table.c.data)).all():
         user = result[0]
-        json_data = result[1]
+        json_data = result[1] or {}
         last_seen = json_data.get("last_seen")
         if last_seen:
             last_seen = datetime.fromtimestamp(last_seen, tz=UTC)
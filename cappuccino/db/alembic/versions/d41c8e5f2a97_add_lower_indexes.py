@@ -0,0 +1,39 @@
+"""add indexes for case-insensitive lookups
+
+Revision ID: d41c8e5f2a97
+Revises: 15a2d5ea1971
+Create Date: 2026-10-18 14:12:37.518204
+
+"""
+
+import sqlalchemy as sa
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "d41c8e5f2a97"
+down_revision = "15a2d5ea1971"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index("ix_ricedb_lower_nick", "ricedb", [sa.text("lower(nick)")])
+    op.create_index(
+        "ix_triggers_lower_channel_lower_name",
+        "triggers",
+        [sa.text("lower(channel)"), sa.text("lower(name)")],
+    )
+    op.create_index(
+        "ix_ai_channels_lower_name", "ai_channels", [sa.text("lower(name)")]
+    )
+    op.create_index(
+        "ix_ai_corpus_lower_channel_name", "ai_corpus", [sa.text("lower(channel_name)")]
+    )
+
+
+def downgrade():
+    op.drop_index("ix_ai_corpus_lower_channel_name", table_name="ai_corpus")
+    op.drop_index("ix_ai_channels_lower_name", table_name="ai_channels")
+    op.drop_index("ix_triggers_lower_channel_lower_name", table_name="triggers")
+    op.drop_index("ix_ricedb_lower_nick", table_name="ricedb")
@@ -13,7 +13,7 @@
 #  You should have received a copy of the GNU General Public License
 #  along with cappuccino.  If not, see <https://www.gnu.org/licenses/>.
 
-from sqlalchemy import Boolean, ForeignKey, Text
+from sqlalchemy import BigInteger, Boolean, ForeignKey, Identity, Index, Text, func
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 
 from cappuccino.db.models import BaseModel
@@ -23,6 +23,8 @@ class CorpusLine(BaseModel):
     __tablename__ = "ai_corpus"
 
     line: Mapped[str] = mapped_column(Text, nullable=False, primary_key=True)
+    # In the order lines were added, for sampling them without sorting the table.
+    id: Mapped[int] = mapped_column(BigInteger, Identity(), nullable=False)
     channel_name: Mapped[str] = mapped_column(
         Text, ForeignKey("ai_channels.name"), nullable=False
     )
@@ -35,3 +37,14 @@ class AIChannel(BaseModel):
     name: Mapped[str] = mapped_column(Text, nullable=False, primary_key=True)
     enabled: Mapped[bool] = mapped_column(Boolean, nullable=False, default=False)
     lines: Mapped[list[CorpusLine]] = relationship(back_populates="channel")
+
+
+# Channels are looked up case-insensitively.
+Index("ix_ai_channels_lower_name", func.lower(AIChannel.name))
+Index("ix_ai_corpus_id", CorpusLine.id, unique=True)
+# Also used to sample a single channel's lines.
+Index(
+    "ix_ai_corpus_lower_channel_name_id",
+    func.lower(CorpusLine.channel_name),
+    CorpusLine.id,
+)
@@ -13,7 +13,7 @@
 #  You should have received a copy of the GNU General Public License
 #  along with cappuccino.  If not, see <https://www.gnu.org/licenses/>.
 
-from sqlalchemy import Text
+from sqlalchemy import Index, Text, func
 from sqlalchemy.orm import Mapped, mapped_column
 
 from cappuccino.db.models import BaseModel
@@ -25,3 +25,11 @@ class Trigger(BaseModel):
     name: Mapped[str] = mapped_column(Text, nullable=False, primary_key=True)
     channel: Mapped[str] = mapped_column(Text, nullable=False, primary_key=True)
     response: Mapped[str] = mapped_column(Text, nullable=False, unique=False)
+
+
+# Triggers are looked up case-insensitively, by channel alone or with their name.
+Index(
+    "ix_triggers_lower_channel_lower_name",
+    func.lower(Trigger.channel),
+    func.lower(Trigger.name),
+)
@@ -13,9 +13,12 @@
 #  You should have received a copy of the GNU General Public License
 #  along with cappuccino.  If not, see <https://www.gnu.org/licenses/>.
 
+import functools
+import operator
 from datetime import datetime  # noqa: TC003
 
-from sqlalchemy import JSON, DateTime, Text, func
+from sqlalchemy import DateTime, Index, Text, cast, func, literal
+from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.orm import Mapped, mapped_column
 
 from cappuccino.db.models import BaseModel
@@ -25,43 +28,75 @@ class RiceDB(BaseModel):
     __tablename__ = "ricedb"
 
     nick: Mapped[str] = mapped_column(Text, nullable=False, primary_key=True)
-    dtops: Mapped[JSON | None] = mapped_column(
-        JSON,
+    dtops: Mapped[JSONB | None] = mapped_column(
+        JSONB,
         nullable=True,
     )
-    homescreens: Mapped[JSON | None] = mapped_column(
-        JSON,
+    homescreens: Mapped[JSONB | None] = mapped_column(
+        JSONB,
         nullable=True,
     )
-    stations: Mapped[JSON | None] = mapped_column(
-        JSON,
+    stations: Mapped[JSONB | None] = mapped_column(
+        JSONB,
         nullable=True,
     )
-    pets: Mapped[JSON | None] = mapped_column(
-        JSON,
+    pets: Mapped[JSONB | None] = mapped_column(
+        JSONB,
         nullable=True,
     )
-    dotfiles: Mapped[JSON | None] = mapped_column(
-        JSON,
+    dotfiles: Mapped[JSONB | None] = mapped_column(
+        JSONB,
         nullable=True,
     )
-    handwritings: Mapped[JSON | None] = mapped_column(
-        JSON,
+    handwritings: Mapped[JSONB | None] = mapped_column(
+        JSONB,
         nullable=True,
     )
-    distros: Mapped[JSON | None] = mapped_column(
-        JSON,
+    distros: Mapped[JSONB | None] = mapped_column(
+        JSONB,
         nullable=True,
     )
-    websites: Mapped[JSON | None] = mapped_column(
-        JSON,
+    websites: Mapped[JSONB | None] = mapped_column(
+        JSONB,
         nullable=True,
     )
-    selfies: Mapped[JSON | None] = mapped_column(
-        JSON,
+    selfies: Mapped[JSONB | None] = mapped_column(
+        JSONB,
         nullable=True,
     )
     lastfm: Mapped[str] = mapped_column(Text, nullable=True)
     last_seen: Mapped[datetime] = mapped_column(
         DateTime(timezone=True), nullable=True, server_default=func.now()
     )
+    # When any of the user's values other than last_seen last changed, for
+    # syncing just the changes.
+    updated_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True), nullable=False, server_default=func.now()
+    )
+
+
+# Nicks are looked up case-insensitively.
+Index("ix_ricedb_lower_nick", func.lower(RiceDB.nick))
+# The change feed pages through users in this order.
+Index("ix_ricedb_updated_at_nick", RiceDB.updated_at, RiceDB.nick)
+
+
+# Every one of a user's lists as one lowercased string, for searching them all
+# at once. Literals rather than parameters, so that queries match the index.
+SEARCH_TEXT = func.lower(
+    functools.reduce(
+        operator.add,
+        [
+            func.coalesce(cast(column, Text), literal("", literal_execute=True))
+            for column in RiceDB.__table__.columns
+            if isinstance(column.type, JSONB)
+        ],
+    )
+).label("search_text")
+# Trigram index for substring searches of SEARCH_TEXT.
+Index(
+    "ix_ricedb_search_text",
+    SEARCH_TEXT,
+    postgresql_using="gin",
+    postgresql_ops={"search_text": "gin_trgm_ops"},
+)
@@ -17,7 +17,7 @@ import secrets
 import subprocess
 
 import irc3
-import requests
+from httpx import HTTPError
 from irc3.plugins.command import command
 
 from cappuccino import Plugin
@@ -50,14 +50,14 @@ class ExecShell(Plugin):
     @command(
         permission="admin", show_in_help_list=False, options_first=True, use_shlex=True
     )
-    def exec(self, mask, target, args):
+    async def exec(self, mask, target, args):
         """Run a system command and upload the output to 0x0.st.
 
         %%exec <command>...
         """
 
         try:
-            output = _exec_wrapper(args["<command>"])
+            output = await self.run_blocking(_exec_wrapper, args["<command>"])
             if not output:
                 return f"{mask.nick}: Command returned no output."
 
@@ -66,15 +66,15 @@ class ExecShell(Plugin):
                 return f"{mask.nick}: {output}"
 
             # Upload multiline output to 0x0.st to avoid flooding channels.
-            result = self.requests.post(
+            result = await self.http.post(
                 "https://0x0.st",
                 files={"file": (f"cappuccino-{secrets.token_hex()}.txt", output)},
-                expires=1,
+                data={"expires": "1"},
             )
 
         except (
             FileNotFoundError,
-            requests.RequestException,
+            HTTPError,
             subprocess.TimeoutExpired,
         ) as ex:
             return f"{mask.nick}: {ex}"
@@ -17,11 +17,12 @@ import random
 import re
 
 import irc3
+from httpx import HTTPError
 from irc3.plugins.command import command
-from requests import RequestException
 
 from cappuccino import Plugin
 from cappuccino.util.formatting import Color, style
+from cappuccino.util.message import Message, message_event
 
 _RANDOM_CHANCE = 0.33
 _DECIDE_DELIMITERS = [" or ", ",", "|"]
@@ -152,9 +153,10 @@ class Fun(Plugin):
         reply += f"{mask.nick}, please click for your own good: {link}"
         self._reply(target, reply)
 
-    @irc3.event(irc3.rfc.PRIVMSG)
-    def not_the_only_one(self, target, event, mask, data):
-        if event != "PRIVMSG" or not target.is_channel:
+    @message_event()
+    def not_the_only_one(self, message: Message):
+        target, mask, data = message.target, message.mask, message.data
+        if message.is_notice or not target.is_channel:
             return
 
         if re.match(r"(?i)does any\s?(body|one) else.*", data):
@@ -184,17 +186,19 @@ class Fun(Plugin):
         )
 
     @command(permission="view", aliases=["whatthecommit"])
-    def wtc(self, mask, target, args):
+    async def wtc(self, mask, target, args):
         """Grab a random commit message.
 
         %%wtc
         """
 
         try:
-            with self.requests.get("https://whatthecommit.com/index.txt") as response:
-                yield f'git commit -m "{response.text.strip()}"'
-        except RequestException:
-            yield (
+            response = await self.http.get("https://whatthecommit.com/index.txt")
+            response.raise_for_status()
+        except HTTPError:
+            return (
                 "Failed to fetch a random git commit."
                 " Sorry, you'll have to figure one out yourself."
             )
+
+        return f'git commit -m "{response.text.strip()}"'
@@ -0,0 +1,235 @@
+#  This file is part of cappuccino.
+#
+#  cappuccino is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  cappuccino is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with cappuccino.  If not, see <https://www.gnu.org/licenses/>.
+
+"""One small HTTP server, running on the bot's event loop, for every plugin.
+
+Plugins which serve anything require this one and register their routes with
+bot.add_route(). Handlers are coroutines which take a Request and return a
+Response, whose body may be an async iterator to stream it.
+"""
+
+import asyncio
+from dataclasses import dataclass, field
+from http import HTTPStatus
+from typing import TYPE_CHECKING
+from urllib.parse import parse_qsl, urlsplit
+
+import irc3
+
+from cappuccino import Plugin
+from cappuccino.util.metrics import current_plugin
+
+if TYPE_CHECKING:
+    from collections.abc import AsyncIterable, Awaitable, Callable
+
+# Seconds a client has to send its request.
+_REQUEST_TIMEOUT = 5
+# Seconds a client has to read each chunk of a streamed response. Streams often
+# hold a database connection, which a stalled client mustn't keep forever.
+_WRITE_TIMEOUT = 10
+_MAX_HEADERS = 100
+_MAX_BODY_SIZE = 1024 * 1024
+
+
+class HTTPError(Exception):
+    """Raise from a handler to respond with an error status."""
+
+    def __init__(self, status: HTTPStatus, message: str = ""):
+        super().__init__(message or status.phrase)
+        self.status = status
+        self.message = message or status.phrase
+
+
+@dataclass
+class Request:
+    method: str
+    path: str
+    # Only the last value of any repeated parameter.
+    query: dict[str, str]
+    # Header names are lowercased.
+    headers: dict[str, str]
+    body: bytes = b""
+
+
+@dataclass
+class Response:
+    body: bytes | str | AsyncIterable[bytes] = b""
+    status: HTTPStatus = HTTPStatus.OK
+    content_type: str = "text/plain; charset=utf-8"
+    headers: dict[str, str] = field(default_factory=dict)
+
+
+async def _read_request(reader: asyncio.StreamReader) -> Request:
+    request_line = await reader.readline()
+    try:
+        method, target, _ = request_line.decode("latin-1").split()
+    except ValueError:
+        raise HTTPError(HTTPStatus.BAD_REQUEST) from None
+
+    headers = {}
+    while (line := await reader.readline()) not in {b"\r\n", b"\n", b""}:
+        if len(headers) >= _MAX_HEADERS:
+            raise HTTPError(HTTPStatus.REQUEST_HEADER_FIELDS_TOO_LARGE)
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+
+    length = headers.get("content-length", "0")
+    if not length.isdigit():
+        raise HTTPError(HTTPStatus.BAD_REQUEST)
+    if int(length) > _MAX_BODY_SIZE:
+        raise HTTPError(HTTPStatus.REQUEST_ENTITY_TOO_LARGE)
+    body = await reader.readexactly(int(length))
+
+    url = urlsplit(target)
+    return Request(
+        method=method.upper(),
+        path=url.path.rstrip("/") or "/",
+        query=dict(parse_qsl(url.query)),
+        headers=headers,
+        body=body,
+    )
+
+
+def _error_response(error: HTTPError) -> Response:
+    return Response(f"{error.message}\n", status=error.status)
+
+
+@irc3.plugin
+class HttpServer(Plugin):
+    def __init__(self, bot):
+        super().__init__(bot)
+        self._host: str = self._setting("host", "http_host", "127.0.0.1")
+        self._port: int = int(self._setting("port", "http_port", 8080))
+        self._server: asyncio.Server | None = None
+        # path -> method -> handler
+        self._routes: dict[
+            str, dict[str, Callable[[Request], Awaitable[Response]]]
+        ] = {}
+        self.bot.create_task(self._serve())
+
+    def _setting(self, key: str, userdb_key: str, default):
+        """Falls back to where userdb's own server used to be configured."""
+        if key in self.config:
+            return self.config[key]
+
+        userdb_config = self.bot.config.get("cappuccino.userdb", {})
+        if userdb_key not in userdb_config:
+            return default
+
+        self.logger.warning(
+            f"[cappuccino.userdb] {userdb_key} is deprecated,"
+            f" set {key} in [cappuccino.httpserver] instead."
+        )
+        return userdb_config[userdb_key]
+
+    @irc3.extend
+    def add_route(
+        self,
+        path: str,
+        handler: Callable[[Request], Awaitable[Response]],
+        methods=("GET",),
+    ):
+        """Serves path with handler, replacing any handler it already had."""
+        path = path.rstrip("/") or "/"
+        for method in methods:
+            self._routes.setdefault(path, {})[method.upper()] = handler
+
+    async def _serve(self):
+        try:
+            self._server = await asyncio.start_server(
+                self._handle_client, self._host, self._port
+            )
+        except OSError:
+            self.logger.exception(f"Couldn't listen on {self._host}:{self._port}.")
+            return
+
+        host, port, *_ = self._server.sockets[0].getsockname()
+        self.logger.info(f"Serving HTTP on http://{host}:{port}")
+
+    def _handler(self, request: Request) -> Callable[[Request], Awaitable[Response]]:
+        methods = self._routes.get(request.path)
+        if methods is None:
+            raise HTTPError(HTTPStatus.NOT_FOUND)
+        if request.method not in methods:
+            raise HTTPError(HTTPStatus.METHOD_NOT_ALLOWED)
+        return methods[request.method]
+
+    async def _respond(self, request: Request) -> Response:
+        handler = self._handler(request)
+        plugin = getattr(handler, "__self__", None)
+        if isinstance(plugin, Plugin):
+            # Attribute the handler's queries and requests to its plugin.
+            current_plugin.set(plugin.__class__.__module__)
+        return await handler(request)
+
+    async def _handle_client(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ):
+        try:
+            try:
+                async with asyncio.timeout(_REQUEST_TIMEOUT):
+                    request = await _read_request(reader)
+                response = await self._respond(request)
+            except HTTPError as error:
+                response = _error_response(error)
+            except (TimeoutError, asyncio.IncompleteReadError, ConnectionError):
+                return
+            except Exception:
+                self.logger.exception("Error handling an HTTP request.")
+                response = _error_response(HTTPError(HTTPStatus.INTERNAL_SERVER_ERROR))
+
+            await self._write_response(writer, response)
+        except (TimeoutError, ConnectionError):
+            pass
+        except Exception:
+            # Too late to send an error, the response has already started.
+            self.logger.exception("Error sending an HTTP response.")
+        finally:
+            writer.close()
+
+    async def _write_response(self, writer: asyncio.StreamWriter, response: Response):
+        body = response.body
+        if isinstance(body, str):
+            body = body.encode("UTF-8")
+
+        headers = {"Content-Type": response.content_type, **response.headers}
+        if isinstance(body, bytes):
+            headers["Content-Length"] = str(len(body))
+        else:
+            headers["Transfer-Encoding"] = "chunked"
+        headers["Connection"] = "close"
+
+        head = f"HTTP/1.1 {response.status.value} {response.status.phrase}\r\n"
+        head += "".join(f"{name}: {value}\r\n" for name, value in headers.items())
+        writer.write(f"{head}\r\n".encode("latin-1"))
+
+        try:
+            if isinstance(body, bytes):
+                writer.write(body)
+            else:
+                async for chunk in body:
+                    if not chunk:
+                        # An empty chunk would end the body.
+                        continue
+                    writer.write(b"%x\r\n%b\r\n" % (len(chunk), chunk))
+                    async with asyncio.timeout(_WRITE_TIMEOUT):
+                        await writer.drain()
+                writer.write(b"0\r\n\r\n")
+            async with asyncio.timeout(_WRITE_TIMEOUT):
+                await writer.drain()
+        finally:
+            # Let a streamed body clean up even if the client went away mid-stream.
+            if hasattr(body, "aclose"):
+                await body.aclose()
@@ -17,10 +17,10 @@ from datetime import UTC, datetime
 from typing import TYPE_CHECKING
 
 import irc3
-from influxdb_client import InfluxDBClient, Point
 from irc3 import rfc
 
 from cappuccino import Plugin
+from cappuccino.util.message import Message, message_event
 
 if TYPE_CHECKING:
     from irc3.utils import IrcString
@@ -41,6 +41,9 @@ class Influx(Plugin):
             self.logger.error("InfluxDB requires *all* config keys to be set.")
             return
 
+        # Slow to import, so only pay for it when InfluxDB is configured.
+        from influxdb_client import InfluxDBClient  # noqa: PLC0415
+
         self._client = InfluxDBClient(url=self._url, token=self._token, org=self._org)
 
     def _record_event(
@@ -57,6 +60,8 @@ class Influx(Plugin):
         if user.is_user:
             user = user.nick
 
+        from influxdb_client import Point  # noqa: PLC0415
+
         data = data.replace("\x00", "") if data else ""
 
         with self._client.write_api() as write_api:
@@ -72,6 +77,8 @@ class Influx(Plugin):
             write_api.write(bucket=self._bucket, org=self._org, record=point)
 
     def _record_user_count(self, channel):
+        from influxdb_client import Point  # noqa: PLC0415
+
         with self._client.write_api() as write_api:
             point = (
                 Point("channel_members")
@@ -81,13 +88,19 @@ class Influx(Plugin):
             )
             write_api.write(bucket=self._bucket, org=self._org, record=point)
 
-    @irc3.event(rfc.PRIVMSG)
-    @irc3.event(rfc.PRIVMSG, iotype="out")
-    def on_privmsg(self, mask=None, event=None, target=None, data=None):
-        if event == "NOTICE" or data.startswith("\x01VERSION") or not target.is_channel:
+    @message_event()
+    @message_event(iotype="out")
+    def on_privmsg(self, message: Message):
+        if (
+            message.is_notice
+            or message.ctcp == "VERSION"
+            or not message.target.is_channel
+        ):
             return
 
-        self._record_event(event, user=mask, data=data, channel=target)
+        self._record_event(
+            message.event, user=message.mask, data=message.data, channel=message.target
+        )
 
     @irc3.event(rfc.JOIN_PART_QUIT)
     @irc3.event(rfc.JOIN_PART_QUIT, iotype="out")
@@ -14,7 +14,6 @@
 #  along with cappuccino.  If not, see <https://www.gnu.org/licenses/>.
 
 import irc3
-import pylast
 from irc3.plugins.command import command
 
 from cappuccino import Plugin
@@ -47,10 +46,15 @@ class LastFM(Plugin):
             self.logger.error("Missing last.fm API key")
             return
 
+        # pylast is slow to import, so it's only loaded when it's configured.
+        import pylast  # noqa: PLC0415
+
         self._lastfm = pylast.LastFMNetwork(api_key=api_key)
 
     def _set_lastfm_username(self, irc_username: str, lastfm_username: str) -> str:
         """Verify and set a user's last.fm username."""
+        import pylast  # noqa: PLC0415
+
         try:
             lastfm_username = self._lastfm.get_user(lastfm_username).get_name(
                 properly_capitalized=True
@@ -67,6 +71,7 @@ class LastFM(Plugin):
 
         %%np [(-s | --set) <username> | <username>]
         """
+        import pylast  # noqa: PLC0415
 
         if args["--set"] or args["-s"]:
             return self._set_lastfm_username(mask.nick, args["<username>"])
@@ -0,0 +1,130 @@
+#  This file is part of cappuccino.
+#
+#  cappuccino is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  cappuccino is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with cappuccino.  If not, see <https://www.gnu.org/licenses/>.
+
+import irc3
+from irc3.plugins.command import Commands
+
+from cappuccino import Plugin
+from cappuccino.httpserver import Request, Response
+from cappuccino.util.metrics import CONTENT_TYPE, REGISTRY, Gauge, instrument
+
+_COMMANDS_PLUGIN = f"{Commands.__module__}.{Commands.__name__}"
+
+_DB_CONNECTIONS = REGISTRY.register(
+    Gauge(
+        "cappuccino_db_connections",
+        "Database connections currently checked out.",
+        ("engine",),
+    )
+)
+_DB_MAX_CONNECTIONS = REGISTRY.register(
+    Gauge(
+        "cappuccino_db_max_connections",
+        "The most database connections an engine may open.",
+        ("engine",),
+    )
+)
+_DB_PLUGIN_CONNECTIONS = REGISTRY.register(
+    Gauge(
+        "cappuccino_db_plugin_connections",
+        "Database sessions currently held open by each plugin.",
+        ("engine", "plugin"),
+    )
+)
+_DB_POOL_WAIT = REGISTRY.register(
+    Gauge(
+        "cappuccino_db_pool_wait_seconds_total",
+        "Total time spent waiting for a pooled database connection.",
+        ("engine",),
+    )
+)
+_EXECUTOR_THREADS = REGISTRY.register(
+    Gauge(
+        "cappuccino_executor_tasks",
+        "Blocking tasks per plugin which are running, queued for a thread,"
+        " or waiting for the plugin's quota.",
+        ("plugin", "state"),
+    )
+)
+_EXECUTOR_WAIT = REGISTRY.register(
+    Gauge(
+        "cappuccino_executor_wait_seconds_total",
+        "Total time blocking tasks waited before starting, per plugin.",
+        ("plugin",),
+    )
+)
+
+
+@irc3.plugin
+class Metrics(Plugin):
+    """Serves Prometheus metrics and instruments every other plugin's handlers."""
+
+    def __init__(self, bot):
+        super().__init__(bot)
+        REGISTRY.set_collector(__name__, self._collect)
+        if self.config.get("enable_http_server", False):
+            # Only listen when asked to, not for every bot with metrics loaded.
+            if "cappuccino.httpserver" not in self.bot.registry.includes:
+                self.bot.include("cappuccino.httpserver")
+            self.bot.add_route("/metrics", self._metrics)
+
+    def connection_ready(self):
+        # Every plugin has been included by now.
+        self._instrument_handlers()
+
+    def after_reload(self):
+        self._instrument_handlers()
+
+    def _instrumented(self, callback, kind: str):
+        if getattr(callback, "instrumented", False):
+            return callback
+
+        plugin = getattr(callback, "__self__", None)
+        if not isinstance(plugin, Plugin):
+            return callback
+
+        return instrument(
+            callback, plugin.__class__.__module__, callback.__name__, kind
+        )
+
+    def _instrument_handlers(self):
+        for events in self.bot.registry.events.values():
+            for handlers in events.values():
+                for event in handlers:
+                    event.callback = self._instrumented(event.callback, "event")
+
+        commands = self.bot.registry.plugins.get(_COMMANDS_PLUGIN)
+        if commands is None:
+            return
+
+        for name, (predicates, callback) in list(commands.items()):
+            commands[name] = (predicates, self._instrumented(callback, "command"))
+
+    def _collect(self):
+        for engine, stats in self.db.stats().items():
+            _DB_CONNECTIONS.set(stats.checked_out, engine=engine)
+            _DB_MAX_CONNECTIONS.set(stats.max_connections, engine=engine)
+            _DB_POOL_WAIT.set(stats.wait_time_total, engine=engine)
+            for plugin, checked_out in stats.plugins.items():
+                _DB_PLUGIN_CONNECTIONS.set(checked_out, engine=engine, plugin=plugin)
+
+        for plugin, stats in self.executor.stats().plugins.items():
+            _EXECUTOR_THREADS.set(stats.running, plugin=plugin, state="running")
+            _EXECUTOR_THREADS.set(stats.queued, plugin=plugin, state="queued")
+            _EXECUTOR_THREADS.set(stats.waiting, plugin=plugin, state="waiting")
+            _EXECUTOR_WAIT.set(stats.wait_time_total, plugin=plugin)
+
+    async def _metrics(self, request: Request) -> Response:
+        return Response(REGISTRY.render(), content_type=CONTENT_TYPE)
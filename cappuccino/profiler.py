@@ -0,0 +1,125 @@
+#  This file is part of cappuccino.
+#
+#  cappuccino is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  cappuccino is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with cappuccino.  If not, see <https://www.gnu.org/licenses/>.
+
+import importlib
+import sys
+import time
+from collections import defaultdict
+
+import irc3
+
+from cappuccino import Plugin
+from cappuccino.util.metrics import REGISTRY, Gauge
+
+_STARTUP_TIME = REGISTRY.register(
+    Gauge(
+        "cappuccino_startup_seconds",
+        "Time each plugin took to import and initialise.",
+        ("plugin", "phase"),
+    )
+)
+_REGISTRATION_TIME = REGISTRY.register(
+    Gauge(
+        "cappuccino_startup_registration_seconds",
+        "Time from loading plugins to registering with the IRC server.",
+    )
+)
+
+
+@irc3.plugin
+class StartupProfiler(Plugin):
+    """Reports how long each plugin took to import and initialise.
+
+    It can only see plugins loaded after it, so it should be the first include.
+    """
+
+    def __init__(self, bot):
+        super().__init__(bot)
+        self._start = time.perf_counter()
+        self._reported = False
+        # plugin module -> phase -> seconds
+        self._timings: dict[str, dict[str, float]] = defaultdict(
+            lambda: {"import": 0.0, "init": 0.0}
+        )
+        # Time spent initialising plugins required by the one on top of the stack.
+        self._nested_init_time: list[float] = []
+
+        self._import_includes()
+        # Shadow the bot's method so plugins included after us are timed.
+        self._get_plugin = self.bot.get_plugin
+        self.bot.get_plugin = self._timed_get_plugin
+
+    def _import_includes(self):
+        # irc3 imports each include just before initialising it, so import the
+        # rest ahead of time to measure them separately. Its imports are then
+        # free, and it still handles anything that fails here.
+        includes = self.bot.config.get("includes", [])
+        if __name__ in includes:
+            includes = includes[includes.index(__name__) + 1 :]
+
+        for module in includes:
+            if module in sys.modules:
+                continue
+
+            start = time.perf_counter()
+            try:
+                importlib.import_module(module)
+            except Exception:  # noqa: BLE001
+                # irc3 will report it properly when it gets there.
+                self.logger.debug(f"Couldn't import {module} ahead of time.")
+            else:
+                self._timings[module]["import"] = time.perf_counter() - start
+
+    def _timed_get_plugin(self, ob):
+        name = ob if isinstance(ob, str) else f"{ob.__module__}.{ob.__name__}"
+        if name in self.bot.registry.plugins:
+            return self._get_plugin(ob)
+
+        self._nested_init_time.append(0.0)
+        start = time.perf_counter()
+        try:
+            return self._get_plugin(ob)
+        finally:
+            elapsed = time.perf_counter() - start
+            nested = self._nested_init_time.pop()
+            if self._nested_init_time:
+                self._nested_init_time[-1] += elapsed
+            self._timings[name.rpartition(".")[0]]["init"] += elapsed - nested
+
+    def server_ready(self):
+        if self._reported:
+            return
+
+        self._reported = True
+        # Everything has been loaded by now, stop timing reloads.
+        del self.bot.get_plugin
+
+        registration_time = time.perf_counter() - self._start
+        _REGISTRATION_TIME.set(registration_time)
+        self.logger.info(
+            f"Registered with the server {registration_time:.2f} seconds"
+            " after loading plugins."
+        )
+
+        timings = sorted(
+            self._timings.items(), key=lambda item: sum(item[1].values()), reverse=True
+        )
+        for module, phases in timings:
+            for phase, seconds in phases.items():
+                _STARTUP_TIME.set(seconds, plugin=module, phase=phase)
+            self.logger.info(
+                f"{module}: imported in {phases['import'] * 1000:.0f}ms,"
+                f" initialised in {phases['init'] * 1000:.0f}ms."
+            )
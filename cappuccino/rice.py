@@ -22,6 +22,9 @@ from irc3.plugins.command import command
 from cappuccino import Plugin
 from cappuccino.util.formatting import Color, style
 
+# Users listed per page of search results.
+_SEARCH_PAGE_SIZE = 5
+
 
 def _to_user_index(index: int):
     """Converts a zero-indexed value to a user-friendly value starting from 1"""
@@ -42,6 +45,60 @@ class Rice(Plugin):
         super().__init__(bot)
         self._max_user_entries: int = self.config.get("max_user_entries", 6)
 
+    def _add(self, nick: str, category: str, values: list[str]) -> str:
+        # The length check happens in the same statement as the append, so
+        # concurrent adds can't take anyone past the limit.
+        if (
+            self.bot.add_user_list_values(
+                nick, category, values, self._max_user_entries
+            )
+            is None
+        ):
+            return (
+                f"You can only set {self._max_user_entries} {category}!"
+                f" Consider deleting or replacing some."
+            )
+        return f"{category} updated."
+
+    def _delete(self, nick: str, category: str, ids: set[str]) -> str:
+        if "*" in ids:
+            if not self.bot.get_user_value(nick, category):
+                return f"You do not have any {category} to remove."
+            self.bot.del_user_value(nick, category)
+            return f"Removed all of your {category}."
+
+        try:
+            indexes = sorted({_from_user_index(index) for index in ids})
+        except ValueError:
+            return "Invalid ID(s)"
+
+        result = self.bot.delete_user_list_values(nick, category, indexes)
+        if result is None:
+            if not self.bot.get_user_value(nick, category):
+                return f"You do not have any {category} to remove."
+            return f"No {category} were removed. Maybe you supplied the wrong IDs?"
+
+        _, deleted = result
+        deleted = ", ".join(style(value, reset=True) for value in deleted)
+        return f"Removed {deleted}."
+
+    def _replace(self, nick: str, category: str, user_index: str, replacement: str):
+        try:
+            index = _from_user_index(user_index)
+        except ValueError:
+            return "Invalid ID"
+
+        result = self.bot.replace_user_list_value(nick, category, index, replacement)
+        if result is None:
+            if not self.bot.get_user_value(nick, category):
+                return f"You do not have any {category} to replace."
+            return "Invalid ID."
+
+        _, old_value = result
+        old_value = style(old_value, reset=True)
+        replacement = style(replacement, reset=True)
+        return f"Replaced {old_value} with {replacement}"
+
     def _generic_db(self, mask, target, args):  # noqa: C901
         # Get name of command _generic_db is being called from.
         category = inspect.stack()[1][3]
@@ -56,17 +113,7 @@ class Rice(Plugin):
         response = None
 
         if args["--add"] or args["-a"]:
-            values = self.bot.get_user_value(mask.nick, category) or []
-            if len(values) + len(args["<values>"]) > self._max_user_entries:
-                response = (
-                    f"You can only set {self._max_user_entries} {category}!"
-                    f" Consider deleting or replacing some."
-                )
-            else:
-                for value in args["<values>"]:
-                    values.append(value)
-                self.bot.set_user_value(mask.nick, category, values)
-                response = f"{category} updated."
+            response = self._add(mask.nick, category, args["<values>"])
 
         elif args["--set"] or args["-s"]:
             values = args["<values>"]
@@ -80,56 +127,12 @@ class Rice(Plugin):
                 response = f"{category} updated."
 
         elif args["--delete"] or args["-d"]:
-            values = self.bot.get_user_value(mask.nick, category)
-            if not values:
-                response = f"You do not have any {category} to remove."
-            else:
-                indexes = set(args["<ids>"])
-                if "*" in indexes:
-                    self.bot.del_user_value(mask.nick, category)
-                    response = f"Removed all of your {category}."
-                else:
-                    deleted_list = []
-                    for index in sorted(indexes, reverse=True):
-                        try:
-                            index = _from_user_index(index)
-                            deleted_list.append(values[index])
-                            del values[index]
-                        except IndexError:
-                            pass
-                        except ValueError:
-                            response = "Invalid ID(s)"
-                            break
-                    if not response:
-                        if not deleted_list:
-                            response = f"No {category} were removed. Maybe you supplied the wrong IDs?"
-                        else:
-                            self.bot.set_user_value(mask.nick, category, values)
-                            deleted_list = ", ".join(
-                                [style(deleted, reset=True) for deleted in deleted_list]
-                            )
-                            response = f"Removed {deleted_list}."
+            response = self._delete(mask.nick, category, set(args["<ids>"]))
 
         elif args["--replace"] or args["-r"]:
-            try:
-                index = _from_user_index(args["<id>"])
-            except ValueError:
-                response = "Invalid ID"
-            else:
-                replacement = args["<value>"].strip()
-                values = self.bot.get_user_value(mask.nick, category)
-                if not values:
-                    response = f"You do not have any {category} to replace."
-                else:
-                    try:
-                        old_value = values[index]
-                        values[index] = replacement
-                        self.bot.set_user_value(mask.nick, category, values)
-                        old_value = style(old_value, reset=True)
-                        replacement = style(replacement, reset=True)
-                        response = f"Replaced {old_value} with {replacement}"
-                    except IndexError:
-                        response = "Invalid ID."
+            response = self._replace(
+                mask.nick, category, args["<id>"], args["<value>"].strip()
+            )
 
         elif args["<user>"] is not None and re.match(
             "^https?://.*", args["<user>"], re.IGNORECASE | re.DOTALL
@@ -178,6 +181,46 @@ class Rice(Plugin):
 
         return f"{user} has no {category}."
 
+    @command(permission="view")
+    def rice(self, mask, target, args):
+        """Searches everyone's rice.
+
+        %%rice search <term>... [--page=<page>]
+        """
+        term = " ".join(args["<term>"])
+        page = args["--page"] or "1"
+        if not page.isdigit() or int(page) < 1:
+            yield "Invalid page."
+            return
+        page = int(page)
+
+        offset = (page - 1) * _SEARCH_PAGE_SIZE
+        try:
+            # One more than a page, to tell whether there's another one.
+            results = self.bot.search_users(term, _SEARCH_PAGE_SIZE + 1, offset)
+        except ValueError as exc:
+            yield str(exc)
+            return
+
+        if not results:
+            yield f"Nobody has anything matching {term}."
+            return
+
+        seperator = style(" | ", fg=Color.LIGHT_GRAY)
+        for nick, matches in results[:_SEARCH_PAGE_SIZE]:
+            user_tag = style(nick, fg=Color.GREEN)
+            entries = [
+                f"{style(f'{category} #{_to_user_index(index)}', fg=Color.PURPLE)}"
+                f" {style(entry, reset=True)}"
+                for category, found in matches.items()
+                for index, entry in found
+            ]
+            yield f"[{user_tag}] {seperator.join(entries)}"
+
+        if len(results) > _SEARCH_PAGE_SIZE:
+            next_page = f"{self.bot.config.cmd}rice search {term} --page={page + 1}"
+            yield f"More results: {next_page}"
+
     @command(permission="view")
     def station(self, mask, target, args):
         """
@@ -13,7 +13,6 @@
 #  You should have received a copy of the GNU General Public License
 #  along with cappuccino.  If not, see <https://www.gnu.org/licenses/>.
 
-import re
 import subprocess
 from collections import deque
 
@@ -21,9 +20,9 @@ import irc3
 
 from cappuccino import Plugin
 from cappuccino.util.formatting import Color, style
+from cappuccino.util.message import Message, message_event
 
 _SED_PRIVMSG = r"\s*s[/|\\!\.,\\].+"
-_SED_CHECKER = re.compile("^" + _SED_PRIVMSG)
 
 
 def _sed_wrapper(text: str, command: str) -> str:
@@ -64,18 +63,14 @@ class Sed(Plugin):
         super().__init__(bot)
         self._history_buffer: dict[str, deque[tuple[str, str]]] = {}
 
-    @irc3.event(irc3.rfc.PRIVMSG)
-    def update_chat_history(self, target, event, mask, data):
-        if (
-            event != "PRIVMSG"
-            or _SED_CHECKER.match(data)
-            or data.startswith(self.bot.config.cmd)
-        ):
+    @message_event()
+    def update_chat_history(self, message: Message):
+        if message.is_notice or message.is_sed or message.is_command:
             return
 
         # Strip ACTION data and just use the message.
-        data = data.replace("\x01ACTION ", "").replace("\x01", "")
-        line = (mask.nick, data)
+        target = message.target
+        line = (message.mask.nick, message.text)
 
         if target in self._history_buffer:
             self._history_buffer[target].append(line)
@@ -88,14 +83,15 @@ class Sed(Plugin):
     @irc3.event(
         rf":(?P<mask>\S+!\S+@\S+) PRIVMSG (?P<target>\S+) :(?P<command>{_SED_PRIVMSG})"
     )
-    def sed(self, mask, target, command):
+    async def sed(self, mask, target, command):
         if target not in self._history_buffer:
             return
 
-        for target_user, message in reversed(self._history_buffer[target]):
+        # Snapshot the history, it can change while we wait on the executor.
+        for target_user, message in reversed(list(self._history_buffer[target])):
             message = message.strip()
             try:
-                new_message = _edit(message, command)
+                new_message = await self.run_blocking(_edit, message, command)
             except EditorError as error:
                 self.bot.notice(mask.nick, str(error))
                 # Don't even check the rest if the sed command is invalid.
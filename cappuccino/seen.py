@@ -13,29 +13,126 @@
 #  You should have received a copy of the GNU General Public License
 #  along with cappuccino.  If not, see <https://www.gnu.org/licenses/>.
 
+import asyncio
 from datetime import UTC, datetime
 
 import irc3
 from humanize import naturaltime
 from irc3.plugins.command import command
+from sqlalchemy import DateTime, Text, column, func, select, values
+from sqlalchemy.dialects.postgresql import insert
 
 from cappuccino import Plugin
+from cappuccino.db.models.userdb import RiceDB
+from cappuccino.util.message import Message, message_event
 
 _DB_KEY = "last_seen"
 
 
+def _upsert_last_seen(batch: list[tuple[str, datetime]]):
+    pending = values(
+        column("nick", Text),
+        column("last_seen", DateTime(timezone=True)),
+        name="pending",
+    ).data(batch)
+    # Nicks are matched case-insensitively everywhere else, so update whichever
+    # row already exists for a nick rather than adding one in a different case.
+    rows = select(
+        func.coalesce(RiceDB.nick, pending.c.nick), pending.c.last_seen
+    ).select_from(
+        pending.outerjoin(RiceDB, func.lower(RiceDB.nick) == func.lower(pending.c.nick))
+    )
+    statement = insert(RiceDB).from_select(["nick", _DB_KEY], rows)
+    # updated_at is left alone, or /changes would list everyone who speaks.
+    return statement.on_conflict_do_update(
+        index_elements=[RiceDB.nick],
+        set_={_DB_KEY: statement.excluded.last_seen},
+    )
+
+
 @irc3.plugin
 class Seen(Plugin):
+    """Remembers when each nick last spoke in a channel.
+
+    Timestamps are kept in memory and written to the database in batches, rather
+    than in a transaction of their own for every message.
+    """
+
     requires = ["irc3.plugins.command", "cappuccino.userdb"]
 
-    def _get_last_seen(self, nick: str) -> datetime:
-        return self.bot.get_user_value(nick, _DB_KEY)
+    def __init__(self, bot):
+        super().__init__(bot)
+        self._flush_interval = float(self.config.get("flush_interval", 30))
+        self._max_batch_size = int(self.config.get("max_batch_size", 500))
+        # Lowercased nick -> (nick, timestamp) for everything not yet written.
+        self._pending: dict[str, tuple[str, datetime]] = {}
+        # The batch being written right now, still newer than the database.
+        self._flushing: dict[str, tuple[str, datetime]] = {}
+        self._flush_lock = asyncio.Lock()
+        self.bot.create_task(self._flush_periodically())
+        # Otherwise the last batch is lost whenever the container is stopped.
+        self.stop_on_sigterm()
+
+    def SIGINT(self):  # noqa: N802
+        # The loop stops straight after this, so write whatever's left now.
+        pending = self._flushing | self._pending
+        self._flushing = {}
+        self._pending = {}
+        if not pending:
+            return
+
+        try:
+            with self.db_session.begin() as session:
+                for batch in self._batches(pending):
+                    session.execute(_upsert_last_seen(batch))
+        except Exception:
+            self.logger.exception(f"Couldn't save {len(pending)} last seen times.")
+
+    def _batches(self, pending: dict[str, tuple[str, datetime]]):
+        rows = list(pending.values())
+        for start in range(0, len(rows), self._max_batch_size):
+            yield rows[start : start + self._max_batch_size]
+
+    async def _flush_periodically(self):
+        while True:
+            await asyncio.sleep(self._flush_interval)
+            await self._flush()
+
+    async def _flush(self):
+        async with self._flush_lock:
+            if not self._pending:
+                return
+
+            self._flushing, self._pending = self._pending, {}
+            try:
+                async with self.async_db_session.begin() as session:
+                    for batch in self._batches(self._flushing):
+                        await session.execute(_upsert_last_seen(batch))
+            except Exception:
+                self.logger.exception(
+                    f"Couldn't save {len(self._flushing)} last seen times."
+                )
+                # Try again next time, unless they've been seen again since.
+                self._pending = self._flushing | self._pending
+            else:
+                for nick, timestamp in self._flushing.values():
+                    self.bot.cache_user_value(nick, _DB_KEY, timestamp)
+            finally:
+                self._flushing = {}
+
+    async def _get_last_seen(self, nick: str) -> datetime | None:
+        key = nick.lower()
+        if pending := self._pending.get(key) or self._flushing.get(key):
+            return pending[1]
+        return await self.bot.async_get_user_value(nick, _DB_KEY)
 
     def _set_last_seen(self, nick: str, timestamp: datetime):
-        self.bot.set_user_value(nick, _DB_KEY, timestamp)
+        self._pending[nick.lower()] = (nick, timestamp)
+        if len(self._pending) >= self._max_batch_size and not self._flush_lock.locked():
+            self.bot.create_task(self._flush())
 
     @command(permission="view", aliases=["died"])
-    def seen(self, mask, target, args):
+    async def seen(self, mask, target, args):
         """Check when a user was last seen active in any channel.
 
         %%seen <nick>
@@ -49,10 +146,10 @@ class Seen(Plugin):
         if nick.lower() == mask.nick.lower():
             return "Are you seriously asking me that?"
 
-        if not self.bot.get_user_value(nick, _DB_KEY):
+        last_seen = await self._get_last_seen(nick)
+        if not last_seen:
             return f"I haven't seen any activity from {nick} yet."
 
-        last_seen = self._get_last_seen(nick)
         time_now = datetime.now(last_seen.tzinfo)
         duration = naturaltime(time_now - last_seen)
         full_date = last_seen.strftime("%b %d %Y %H:%M %Z")
@@ -62,14 +159,14 @@ class Seen(Plugin):
 
         return f"{nick} was last seen {duration}. ({full_date})"
 
-    @irc3.event(irc3.rfc.PRIVMSG)
-    def on_privmsg(self, target, event, mask, data):
+    @message_event()
+    def on_privmsg(self, message: Message):
         if (
-            event == "NOTICE"
-            or data.startswith("\x01VERSION")
-            or not target.is_channel
-            or mask.nick == self.bot.nick
+            message.is_notice
+            or message.ctcp == "VERSION"
+            or not message.target.is_channel
+            or message.mask.nick == self.bot.nick
         ):
             return
 
-        self._set_last_seen(mask.nick, datetime.now(UTC))
+        self._set_last_seen(message.mask.nick, datetime.now(UTC))
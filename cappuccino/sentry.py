@@ -14,9 +14,7 @@
 #  along with cappuccino.  If not, see <https://www.gnu.org/licenses/>.
 
 import irc3
-import sentry_sdk
-from requests import RequestException
-from sentry_sdk.integrations.sqlalchemy import SqlalchemyIntegration
+from httpx import HTTPError
 
 from cappuccino import Plugin
 from cappuccino.util import meta
@@ -25,7 +23,7 @@ from cappuccino.util import meta
 def _before_send(event, hint):
     if "exc_info" in hint:
         _, exc_value, _ = hint["exc_info"]
-        if isinstance(exc_value, RequestException | TimeoutError):
+        if isinstance(exc_value, HTTPError | TimeoutError):
             return None
 
     return event
@@ -43,6 +41,12 @@ class Sentry(Plugin):
             self.logger.info("Missing Sentry DSN, Sentry is disabled.")
             return
 
+        # sentry_sdk is slow to import, so only pay for it when it's configured.
+        import sentry_sdk  # noqa: PLC0415
+        from sentry_sdk.integrations.sqlalchemy import (  # noqa: PLC0415
+            SqlalchemyIntegration,
+        )
+
         sentry_sdk.init(
             dsn,
             before_send=_before_send,
@@ -13,8 +13,6 @@
 #  You should have received a copy of the GNU General Public License
 #  along with cappuccino.  If not, see <https://www.gnu.org/licenses/>.
 
-import re
-
 import irc3
 from irc3.plugins.command import command
 from sqlalchemy import delete, func, select, update
@@ -23,6 +21,7 @@ from cappuccino import Plugin
 from cappuccino.db.models.triggers import Trigger
 from cappuccino.util.channel import is_chanop
 from cappuccino.util.formatting import Color, style
+from cappuccino.util.message import Message, message_event
 
 
 @irc3.plugin
@@ -32,48 +31,49 @@ class Triggers(Plugin):
     def __init__(self, bot):
         super().__init__(bot)
 
-    def _get_trigger(self, channel: str, name: str):
-        with self.db_session() as session:
-            return session.scalar(
+    async def _get_trigger(self, channel: str, name: str):
+        async with self.async_db_session() as session:
+            return await session.scalar(
                 select(Trigger.response)
                 .where(func.lower(Trigger.name) == name.lower())
                 .where(func.lower(Trigger.channel) == channel.lower())
             )
 
-    def _set_trigger(self, channel: str, name: str, response: str):
-        with self.db_session() as session:
-            trigger_model = session.scalar(
+    async def _set_trigger(self, channel: str, name: str, response: str):
+        async with self.async_db_session.begin() as session:
+            trigger_name = await session.scalar(
                 update(Trigger)
-                .returning(Trigger)
+                .returning(Trigger.name)
                 .where(func.lower(Trigger.name) == name.lower())
                 .where(func.lower(Trigger.channel) == channel.lower())
                 .values(response=response)
             )
 
-            if trigger_model is None:
-                trigger_model = Trigger(name=name, channel=channel, response=response)
-                session.add(trigger_model)
+            if trigger_name is None:
+                session.add(Trigger(name=name, channel=channel, response=response))
 
-    def _delete_trigger(self, channel: str, name: str) -> bool:
-        with self.db_session() as session:
-            trigger_object = session.scalar(
+    async def _delete_trigger(self, channel: str, name: str) -> bool:
+        async with self.async_db_session.begin() as session:
+            trigger_name = await session.scalar(
                 delete(Trigger)
                 .where(func.lower(Trigger.name) == name.lower())
                 .where(func.lower(Trigger.channel) == channel.lower())
-                .returning(Trigger)
+                .returning(Trigger.name)
             )
-            return trigger_object is not None
-
-    def _get_triggers_list(self, channel: str) -> list:
-        with self.db_session() as session:
-            return session.scalars(
-                select(Trigger.name).where(
-                    func.lower(Trigger.channel) == channel.lower()
+            return trigger_name is not None
+
+    async def _get_triggers_list(self, channel: str) -> list:
+        async with self.async_db_session() as session:
+            return (
+                await session.scalars(
+                    select(Trigger.name).where(
+                        func.lower(Trigger.channel) == channel.lower()
+                    )
                 )
             ).all()
 
     @command(permission="view")
-    def trigger(self, mask, target, args):
+    async def trigger(self, mask, target, args):
         """Manages predefined responses to message triggers.
 
         %%trigger (set <name> <response>... | del <name> | list)
@@ -89,16 +89,16 @@ class Triggers(Plugin):
         name = args["<name>"]
 
         if args["set"]:
-            self._set_trigger(target, name, " ".join(args["<response>"]))
+            await self._set_trigger(target, name, " ".join(args["<response>"]))
             response = f"Trigger '{name}' set."
         elif args["del"]:
             response = (
                 f"Deleted trigger '{name}'."
-                if self._delete_trigger(target, name)
+                if await self._delete_trigger(target, name)
                 else "No such trigger."
             )
         elif args["list"]:
-            trigger_list = self._get_triggers_list(target)
+            trigger_list = await self._get_triggers_list(target)
             self.logger.debug(trigger_list)
             if trigger_list:
                 trigger_list = ", ".join(trigger_list)
@@ -108,19 +108,19 @@ class Triggers(Plugin):
 
         return response
 
-    @irc3.event(irc3.rfc.PRIVMSG)
-    def on_privmsg(self, target, event, mask, data):
-        if mask.nick == self.bot.nick or event == "NOTICE":
+    @message_event()
+    async def on_privmsg(self, message: Message):
+        target = message.target
+        if message.mask.nick == self.bot.nick or message.is_notice:
             return
 
-        captured_triggers = re.findall(r"\?([A-Za-z0-9]+)", data)
-        if not captured_triggers:
+        if not message.triggers:
             return
 
-        triggers = set(captured_triggers[:3])
+        triggers = set(message.triggers[:3])
         responses = []
         for trigger in triggers:
-            response = self._get_trigger(target, trigger)
+            response = await self._get_trigger(target, trigger)
             trigger = style(trigger.lower(), fg=Color.ORANGE)
             if response is not None:
                 responses.append(f"[{trigger}] {response}")
@@ -16,7 +16,7 @@
 import asyncio
 
 import irc3
-from httpx import URL, AsyncClient, HTTPError
+from httpx import URL, HTTPError
 from irc3 import rfc
 
 from cappuccino import Plugin
@@ -37,16 +37,15 @@ class UptimeKuma(Plugin):
             self.bot.create_task(self._ping_loop())
 
     async def ping(self, message: str = "OK", status: str = "up"):
-        async with AsyncClient(timeout=5) as client:
-            request_params = {"status": status, "msg": message}
-            request_url = URL(self._webhook, params=request_params)
-            self.logger.debug(f"Pinging {request_url}")
-            try:
-                response = await client.get(request_url)
-                response.raise_for_status()
-                self.logger.debug("Ping succeeded.")
-            except HTTPError:
-                self.logger.exception("Ping failed.")
+        request_params = {"status": status, "msg": message}
+        request_url = URL(self._webhook, params=request_params)
+        self.logger.debug(f"Pinging {request_url}")
+        try:
+            response = await self.http.get(request_url)
+            response.raise_for_status()
+            self.logger.debug("Ping succeeded.")
+        except HTTPError:
+            self.logger.exception("Ping failed.")
 
     async def _ping_loop(self):
         self.logger.info(f"Pinging Uptime Kuma every {self._interval} seconds.")
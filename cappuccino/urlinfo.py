@@ -13,7 +13,7 @@
 #  You should have received a copy of the GNU General Public License
 #  along with cappuccino.  If not, see <https://www.gnu.org/licenses/>.
 
-import concurrent
+import asyncio
 import contextlib
 import html
 import ipaddress
@@ -21,26 +21,27 @@ import random
 import re
 import socket
 import time
-from copy import copy
 from typing import TYPE_CHECKING
 
 if TYPE_CHECKING:
     from email.headerregistry import ContentDispositionHeader, ContentTypeHeader
 
+    import bs4
+
 from email.policy import EmailPolicy
 from io import StringIO
 from urllib.parse import urlparse
 
-import bs4
+import httpx
 import irc3
-import requests
 from humanize import naturalsize
 
 from cappuccino import Plugin
 from cappuccino.util.formatting import Color, style, truncate_with_ellipsis, unstyle
+from cappuccino.util.message import Message, message_event
 
 
-class ResponseBodyTooLarge(requests.RequestException):
+class ResponseBodyTooLarge(httpx.HTTPError):
     pass
 
 
@@ -52,20 +53,10 @@ class ContentTypeNotAllowedError(Exception):
     pass
 
 
-class RequestTimeout(requests.RequestException):
+class RequestTimeout(httpx.HTTPError):
     pass
 
 
-def _clean_url(url: str):
-    if url:
-        url = url.rstrip("'.,\"\1")
-        braces = [("{", "}"), ("<", ">"), ("[", "]"), ("(", ")")]
-        for left_brace, right_brace in braces:
-            if left_brace not in url and url.endswith(right_brace):
-                url = url.rstrip(right_brace)
-    return url
-
-
 def _extract_title_from_soup(soup: bs4.BeautifulSoup):
     if title_tag := soup.find("meta", property="og:title", content=True):
         return title_tag.get("content")
@@ -79,10 +70,25 @@ def _extract_site_name_from_soup(soup: bs4.BeautifulSoup):
     return None
 
 
+def _extract_title(content: str):
+    # bs4 and html5lib take a while to import, don't pay for them until needed.
+    from bs4 import BeautifulSoup  # noqa: PLC0415
+
+    soup = BeautifulSoup(content, "html5lib")
+    title = _extract_title_from_soup(soup)
+
+    site_name = _extract_site_name_from_soup(soup)
+    if (site_name and len(site_name) < (site_name_max_size := 16)) and (
+        len(site_name) > site_name_max_size
+    ):
+        site_name = truncate_with_ellipsis(title, site_name_max_size)
+
+    return title
+
+
 @irc3.plugin
 class UrlInfo(Plugin):
     _max_bytes = 10 * 1000 * 1000  # 10M
-    _url_regex = re.compile(r"https?://\S+", re.IGNORECASE | re.UNICODE)
     _max_title_length = 300
     _request_timeout = 5
     _html_mimetypes = ["text/html", "application/xhtml+xml"]
@@ -93,7 +99,7 @@ class UrlInfo(Plugin):
         super().__init__(bot)
         self._ignore_nicks: list[str] = self.config.get("ignore_nicks", "").split()
         self._ignore_hostnames: list[str] = self.config.get("ignore_hostnames", [])
-        self._real_user_agent: str = self.requests.headers.get("User-Agent")
+        self._real_user_agent: str = self.http.headers.get("User-Agent")
         self._fake_user_agent: str = self.config.get(
             "fake_useragent", "Googlebot/2.1 (+http://www.google.com/bot.html)"
         )
@@ -101,19 +107,22 @@ class UrlInfo(Plugin):
             "fake_useragent_hostnames", []
         )
 
-    @irc3.event(
-        rf"(?iu):(?P<mask>\S+!\S+@\S+) PRIVMSG (?P<target>#\S+) :(?P<data>.*{_url_regex.pattern}).*"
-    )
-    def on_url(self, mask, target, data):  # noqa: C901
-        if mask.nick in self._ignore_nicks or data.startswith(
+    @message_event()
+    async def on_url(self, message: Message):  # noqa: C901
+        mask, target = message.mask, message.target
+        if message.is_notice or not target.is_channel or not message.urls:
+            return
+
+        if mask.nick in self._ignore_nicks or message.data.startswith(
             (self.bot.config.cmd, f"{self.bot.nick}: ")
         ):
             return
 
-        urls = [_clean_url(url) for url in set(self._url_regex.findall(data))] or []
-        for url in urls:
-            if urlparse(url).hostname in self._ignore_hostnames:
-                urls.remove(url)
+        urls = [
+            url
+            for url in message.urls
+            if urlparse(url).hostname not in self._ignore_hostnames
+        ]
 
         if not urls:
             return
@@ -121,58 +130,53 @@ class UrlInfo(Plugin):
         random.shuffle(urls)
         urls = urls[:3]
 
-        with concurrent.futures.ThreadPoolExecutor(max_workers=len(urls)) as executor:
-            messages = []
-            self.logger.debug(f"Retrieving page titles for {urls}")
-
-            future_to_url = {
-                executor.submit(self._process_url, url): url for url in urls
-            }
-            for future in concurrent.futures.as_completed(future_to_url):
-                url = future_to_url[future]
-                hostname = urlparse(url).hostname
-
-                try:
-                    hostname, title, mimetype, size = future.result()
-                except InvalidIPAddressError:
-                    return
-                except ContentTypeNotAllowedError as ex:
-                    self.logger.debug(ex)
-                except (socket.gaierror, ValueError, requests.RequestException) as ex:
-                    hostname = style(hostname, fg=Color.RED)
-
-                    with contextlib.suppress(AttributeError, IndexError):
-                        ex = ex.args[0].reason
-
-                    error = style(ex, bold=True)
-                    if isinstance(ex, requests.RequestException):
-                        if ex.response is not None and ex.response.reason is not None:
-                            status_code = style(ex.response.status_code, bold=True)
-                            error = style(ex.response.reason, bold=True)
-                            messages.append(f"[ {hostname} ] {status_code} {error}")
-                        return
-                    messages.append(f"[ {hostname} ] {error}")
-                # no exception
-                else:
-                    hostname = style(hostname, fg=Color.GREEN)
-                    if title is not None:
-                        title = style(title, bold=True)
-                        reply = f"[ {hostname} ] {title}"
-                        if (size and mimetype) and mimetype != "text/html":
-                            size = naturalsize(size)
-                            reply = f"{reply} ({size} - {mimetype})"
-                        messages.append(reply)
-
-            # Send all parsed URLs now that we have them all.
-            if messages:
-                pipe_character = style(" | ", fg=Color.LIGHT_GRAY)
-                self.bot.privmsg(target, pipe_character.join(messages))
-
-    def _stream_response(self, response: requests.Response) -> str:
+        messages = []
+        self.logger.debug(f"Retrieving page titles for {urls}")
+        results = await asyncio.gather(
+            *(self._process_url(url) for url in urls), return_exceptions=True
+        )
+        for url, result in zip(urls, results, strict=True):
+            hostname = urlparse(url).hostname
+
+            if isinstance(result, InvalidIPAddressError):
+                return
+            if isinstance(result, ContentTypeNotAllowedError):
+                self.logger.debug(result)
+            elif isinstance(result, httpx.HTTPStatusError):
+                hostname = style(hostname, fg=Color.RED)
+                status_code = style(result.response.status_code, bold=True)
+                error = style(result.response.reason_phrase, bold=True)
+                messages.append(f"[ {hostname} ] {status_code} {error}")
+            elif isinstance(result, httpx.HTTPError):
+                self.logger.warning(f"Failed to retrieve {url}: {result}")
+            elif isinstance(result, socket.gaierror | ValueError):
+                hostname = style(hostname, fg=Color.RED)
+                error = style(result, bold=True)
+                messages.append(f"[ {hostname} ] {error}")
+            elif isinstance(result, BaseException):
+                raise result
+            # no exception
+            else:
+                hostname, title, mimetype, size = result
+                hostname = style(hostname, fg=Color.GREEN)
+                if title is not None:
+                    title = style(title, bold=True)
+                    reply = f"[ {hostname} ] {title}"
+                    if (size and mimetype) and mimetype != "text/html":
+                        size = naturalsize(size)
+                        reply = f"{reply} ({size} - {mimetype})"
+                    messages.append(reply)
+
+        # Send all parsed URLs now that we have them all.
+        if messages:
+            pipe_character = style(" | ", fg=Color.LIGHT_GRAY)
+            self.bot.privmsg(target, pipe_character.join(messages))
+
+    async def _stream_response(self, response: httpx.Response) -> str:
         start_time = time.time()
         content = StringIO()
 
-        for chunk in response.iter_content(self._request_chunk_size):
+        async for chunk in response.aiter_bytes(self._request_chunk_size):
             if time.time() - start_time >= self._request_timeout:
                 raise RequestTimeout(
                     f"Request timed out ({self._request_timeout} seconds)."
@@ -188,37 +192,38 @@ class UrlInfo(Plugin):
 
         return content.getvalue()
 
-    def _process_url(self, url: str):
+    async def _process_url(self, url: str):
         urlp = urlparse(url)
         if urlp.netloc.lower().removeprefix("www.") == "twitter.com":
             urlp = urlp._replace(netloc="nitter.net")
         url = urlp.geturl()
 
         hostname = urlp.hostname
-        self._validate_ip_address(hostname)
+        await self._validate_ip_address(hostname)
         hostname = hostname.removeprefix("www.")
 
         # Spoof user agent for certain sites so they give up their secrets.
-        request = copy(self.requests)
+        headers = {}
         if any(
             f".{hostname}".endswith(f".{host}")
             for host in self._fake_useragent_hostnames
         ):
-            request.headers.update({"User-Agent": self._fake_user_agent})
+            headers["User-Agent"] = self._fake_user_agent
 
-        with request.get(url, stream=True) as response:
-            if response.status_code != requests.codes.ok:
+        async with self.http.stream("GET", url, headers=headers) as response:
+            if response.status_code != httpx.codes.OK:
                 response.raise_for_status()
 
             content_type = response.headers.get("Content-Type")
             self._validate_content_type(content_type)
 
-            title, size = self._extract_title_and_size(response, content_type)
+            title, size = await self._extract_title_and_size(response, content_type)
 
         return hostname, title, content_type, size
 
-    def _validate_ip_address(self, hostname: str):
-        for _, _, _, _, sockaddr in socket.getaddrinfo(hostname, None):
+    async def _validate_ip_address(self, hostname: str):
+        loop = asyncio.get_running_loop()
+        for _, _, _, _, sockaddr in await loop.getaddrinfo(hostname, None):
             ip = ipaddress.ip_address(sockaddr[0])
             if not ip.is_global:
                 raise InvalidIPAddressError(
@@ -236,7 +241,9 @@ class UrlInfo(Plugin):
                     f"{main_type} not in {self._allowed_content_types}"
                 )
 
-    def _extract_title_and_size(self, response: requests.Response, content_type: str):
+    async def _extract_title_and_size(
+        self, response: httpx.Response, content_type: str
+    ):
         title = None
         size = int(response.headers.get("Content-Length", 0))
         content_disposition = response.headers.get("Content-Disposition")
@@ -246,18 +253,12 @@ class UrlInfo(Plugin):
             )
             title = header.params.get("filename")
         elif content_type in self._html_mimetypes or content_type == "text/plain":
-            content = self._stream_response(response)
+            content = await self._stream_response(response)
             if content and not size:
                 size = len(content.encode("UTF-8"))
 
-            soup = bs4.BeautifulSoup(content, "html5lib")
-            title = _extract_title_from_soup(soup)
-
-            site_name = _extract_site_name_from_soup(soup)
-            if (site_name and len(site_name) < (site_name_max_size := 16)) and (
-                len(site_name) > site_name_max_size
-            ):
-                site_name = truncate_with_ellipsis(title, site_name_max_size)
+            # html5lib is slow, keep it off the event loop.
+            title = await self.run_blocking(_extract_title, content)
 
             if not title and (content and content_type not in self._html_mimetypes):
                 title = re.sub(r"\s+", " ", " ".join(content.split("\n")))
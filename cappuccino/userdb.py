@@ -13,109 +13,820 @@
 #  You should have received a copy of the GNU General Public License
 #  along with cappuccino.  If not, see <https://www.gnu.org/licenses/>.
 
-import threading
+import asyncio
+import base64
+import binascii
+import contextlib
+import copy
+import gzip
+import json
+import time
+from dataclasses import dataclass
+from datetime import UTC, datetime, timedelta
+from http import HTTPStatus
+from typing import TYPE_CHECKING
 
-import bottle
 from sqlalchemy import (
-    desc,
+    DateTime,
+    Text,
+    case,
+    cast,
     func,
-    inspect,
+    literal,
     nullslast,
+    or_,
     select,
+    true,
+    tuple_,
     update,
 )
+from sqlalchemy.dialects.postgresql import JSONB, aggregate_order_by, array, insert
 
 from cappuccino import Plugin
-from cappuccino.db.models.userdb import RiceDB
+from cappuccino.db.models.userdb import SEARCH_TEXT, RiceDB
+from cappuccino.httpserver import HTTPError, Request, Response
+from cappuccino.util.cache import MISSING, LRUCache
 from cappuccino.util.formatting import unstyle
 
+if TYPE_CHECKING:
+    from collections.abc import Callable, Iterable
+
+import irc3
+
 try:
-    import ujson as json
+    import brotli
 except ImportError:
-    import json
+    brotli = None
 
-import contextlib
+# Rows fetched from the database at a time while streaming the JSON dump.
+_STREAM_BATCH_SIZE = 500
+_CHANGES_LIMIT = 500
+_CHANGES_MAX_LIMIT = 5000
+# The longest a request for changes may wait for one, in seconds.
+_CHANGES_MAX_WAIT = 60
+_SEARCH_LIMIT = 50
+_SEARCH_MAX_LIMIT = 500
+# Shorter terms can't use the trigram index.
+_SEARCH_MIN_LENGTH = 3
+# What unstyle() removes, in the same order.
+_STYLE_CODES = "[\x0f\x02\x1d\x1f]"
+_COLOR_CODES = "\x03[0-9]{2}(,[0-9]{2})?"
 
-import irc3
+
+def _select_user(username: str):
+    return select(*RiceDB.__table__.columns).where(
+        func.lower(RiceDB.nick) == username.lower()
+    )
+
+
+def _user_values(row: dict | None, keys: Iterable[str]) -> dict:
+    if row is None:
+        return dict.fromkeys(keys)
+    # Callers modify the lists they get back before saving them.
+    return {key: copy.deepcopy(row[key]) for key in keys}
+
+
+def _existing_nick(username: str):
+    # Nicks are matched case-insensitively, so update whichever row already
+    # exists for this one rather than adding another in a different case.
+    nick = (
+        select(RiceDB.nick)
+        .where(func.lower(RiceDB.nick) == username.lower())
+        .limit(1)
+        .scalar_subquery()
+    )
+    return func.coalesce(nick, username)
+
+
+def _upsert_values(username: str, values: dict):
+    statement = insert(RiceDB).values(
+        nick=_existing_nick(username), updated_at=func.now(), **values
+    )
+    return statement.on_conflict_do_update(
+        index_elements=[RiceDB.nick],
+        set_={key: statement.excluded[key] for key in [*values, "updated_at"]},
+    ).returning(*RiceDB.__table__.columns)
+
+
+def _as_list(value):
+    # Cleared values are stored as a JSON null, or NULL.
+    return case(
+        (func.jsonb_typeof(value) == "array", value), else_=func.jsonb_build_array()
+    )
+
+
+def _append_entries(username: str, key: str, entries: list, max_entries: int):
+    statement = insert(RiceDB).values(
+        nick=_existing_nick(username), updated_at=func.now(), **{key: entries}
+    )
+    current = _as_list(RiceDB.__table__.columns[key])
+    return statement.on_conflict_do_update(
+        index_elements=[RiceDB.nick],
+        set_={
+            key: current.op("||", return_type=JSONB)(statement.excluded[key]),
+            "updated_at": statement.excluded.updated_at,
+        },
+        where=func.jsonb_array_length(current) + len(entries) <= max_entries,
+    ).returning(*RiceDB.__table__.columns)
+
+
+def _user_list(username: str, key: str):
+    column = RiceDB.__table__.columns[key]
+    return (
+        select(RiceDB.nick, _as_list(column).label("entries"))
+        .where(func.lower(RiceDB.nick) == username.lower())
+        .where(func.jsonb_typeof(column) == "array")
+        .limit(1)
+        .with_for_update()
+    )
+
+
+def _delete_entries(username: str, key: str, indexes: list[int]):
+    """Removes the entries at indexes, which may be negative, from the user's list."""
+    target = _user_list(username, key).cte("target")
+    elements = (
+        func.jsonb_array_elements(target.c.entries)
+        .table_valued("value", with_ordinality="position")
+        .render_derived()
+    )
+    index = elements.c.position - 1
+    removed = or_(
+        index.in_(indexes),
+        (index - func.jsonb_array_length(target.c.entries)).in_(indexes),
+    )
+    entries = (
+        select(elements.c.value, index.label("index"), removed.label("removed"))
+        .select_from(target)
+        .join(elements, true())
+        .cte("entries")
+    )
+
+    def entries_agg(condition):
+        ordered = aggregate_order_by(entries.c.value, entries.c.index)
+        return select(func.jsonb_agg(ordered).filter(condition)).scalar_subquery()
+
+    return (
+        update(RiceDB)
+        .where(RiceDB.nick == target.c.nick)
+        .where(select(entries).where(entries.c.removed).exists())
+        .values(
+            {
+                key: func.coalesce(
+                    entries_agg(~entries.c.removed), func.jsonb_build_array()
+                ),
+                "updated_at": func.now(),
+            }
+        )
+        .returning(*RiceDB.__table__.columns, entries_agg(entries.c.removed))
+    )
+
+
+def _replace_entry(username: str, key: str, index: int, entry: str):
+    """Replaces the entry at index, which may be negative, in the user's list."""
+    column = RiceDB.__table__.columns[key]
+    length = func.jsonb_array_length(_as_list(column))
+    target = (
+        _user_list(username, key)
+        .add_columns(column.op("->", return_type=JSONB)(index).label("replaced"))
+        .where(literal(index) < length)
+        .where(literal(index) >= -length)
+        .cte("target")
+    )
+    return (
+        update(RiceDB)
+        .where(RiceDB.nick == target.c.nick)
+        .values(
+            {
+                key: func.jsonb_set(
+                    column, array([literal(str(index), Text)]), literal(entry, JSONB)
+                ),
+                "updated_at": func.now(),
+            }
+        )
+        .returning(*RiceDB.__table__.columns, target.c.replaced)
+    )
+
+
+def _unstyled(text):
+    """unstyle(), but run by the database."""
+    text = func.regexp_replace(text, _STYLE_CODES, "", "g")
+    return func.regexp_replace(text, _COLOR_CODES, "", "g")
 
 
-def _strip_path():
-    bottle.request.environ["PATH_INFO"] = bottle.request.environ["PATH_INFO"].rstrip(
-        "/"
+def _unstyled_list(column):
+    entries = (
+        func.jsonb_array_elements_text(column)
+        .table_valued("value", with_ordinality="position")
+        .render_derived()
     )
+    unstyled = select(
+        func.jsonb_agg(
+            aggregate_order_by(_unstyled(entries.c.value), entries.c.position)
+        )
+    ).scalar_subquery()
+    # jsonb_agg() of no entries is null, which would drop an empty list.
+    unstyled = func.coalesce(unstyled, func.jsonb_build_array())
+    return case((func.jsonb_typeof(column) == "array", unstyled), else_=column)
+
+
+def _user_json(users, *, with_updated_at: bool = False):
+    """Builds a user's JSON object, without their unset values, in the database.
+
+    updated_at is left out unless asked for, as the dump on / never had it.
+    """
+    fields = []
+    for column in RiceDB.__table__.columns:
+        if column.key == "updated_at" and not with_updated_at:
+            continue
+
+        value = users.c[column.key]
+        if isinstance(column.type, DateTime):
+            value = func.extract("epoch", value)
+        elif isinstance(column.type, JSONB):
+            value = _unstyled_list(value)
+        else:
+            value = _unstyled(value)
+        fields.extend((literal(column.key), value))
+    return cast(func.json_strip_nulls(func.json_build_object(*fields)), Text)
+
+
+def _users_order(columns):
+    # The nick makes the order stable, so that pages don't overlap.
+    return nullslast(columns.last_seen.desc()), columns.nick
+
+
+def _users_page(limit: int | None, offset: int | None):
+    return (
+        select(RiceDB)
+        .order_by(*_users_order(RiceDB))
+        .limit(limit)
+        .offset(offset)
+        .subquery("users")
+    )
+
+
+def _users_etag(users):
+    # Hashing the rows as text is far cheaper than building their JSON.
+    rows = func.string_agg(
+        cast(users.table_valued(), Text),
+        aggregate_order_by(literal("\n"), *_users_order(users.c)),
+    )
+    return select(func.md5(func.coalesce(rows, ""))).select_from(users)
+
+
+def _encode_cursor(updated_at: datetime, nick: str) -> str:
+    cursor = json.dumps([updated_at.isoformat(), nick]).encode("UTF-8")
+    return base64.urlsafe_b64encode(cursor).decode("ascii")
+
+
+def _decode_cursor(cursor: str) -> tuple[datetime, str]:
+    try:
+        updated_at, nick = json.loads(base64.urlsafe_b64decode(cursor))
+        return datetime.fromisoformat(updated_at), nick
+    except (binascii.Error, TypeError, ValueError):
+        raise ValueError("Invalid cursor.") from None
+
+
+def _parse_since(value: str) -> datetime:
+    try:
+        return datetime.fromtimestamp(float(value), UTC)
+    except (OverflowError, OSError, ValueError):
+        raise ValueError("since must be a Unix timestamp.") from None
+
+
+def _changed_users(after: tuple[datetime, str], limit: int, delay: float):
+    """Users changed after the cursor, but at least delay seconds ago.
+
+    updated_at is when a write's transaction started, not when it committed, so
+    a write still in progress can commit with an updated_at below the cursor.
+    Holding back recent changes gives every write delay seconds to commit first.
+    """
+    users = (
+        select(RiceDB)
+        .where(tuple_(RiceDB.updated_at, RiceDB.nick) > tuple_(*after))
+        .where(
+            RiceDB.updated_at < func.statement_timestamp() - timedelta(seconds=delay)
+        )
+        .order_by(RiceDB.updated_at, RiceDB.nick)
+        .limit(limit)
+        .subquery("users")
+    )
+    return (
+        select(
+            _user_json(users, with_updated_at=True), users.c.updated_at, users.c.nick
+        )
+        .select_from(users)
+        .order_by(users.c.updated_at, users.c.nick)
+    )
+
+
+def _search_term(term: str) -> str:
+    term = term.strip().lower()
+    if len(term) < _SEARCH_MIN_LENGTH:
+        raise ValueError(f"Search terms need at least {_SEARCH_MIN_LENGTH} characters.")
+    return term
+
+
+def _search_users(term: str, limit: int, offset: int):
+    # Whole-word matches first, then the most recently seen users.
+    rank = func.strict_word_similarity(term, SEARCH_TEXT)
+    return (
+        select(*RiceDB.__table__.columns)
+        .where(SEARCH_TEXT.contains(term, autoescape=True))
+        .order_by(rank.desc(), *_users_order(RiceDB))
+        .limit(limit)
+        .offset(offset)
+    )
+
+
+def _matching_entries(row, term: str) -> dict[str, list[tuple[int, str]]]:
+    """The user's entries containing term, with their indexes, by list."""
+    matches = {}
+    for column in RiceDB.__table__.columns:
+        entries = getattr(row, column.key)
+        if not isinstance(column.type, JSONB) or not isinstance(entries, list):
+            continue
+        found = [
+            (index, entry)
+            for index, entry in enumerate(entries)
+            if term in str(entry).lower()
+        ]
+        if found:
+            matches[column.key] = found
+    return matches
+
+
+@dataclass
+class _Reads:
+    """Reads of one user's row in progress, and writes to it made meanwhile."""
+
+    count: int = 0
+    writes: int = 0
+
+
+@dataclass(frozen=True)
+class _Snapshot:
+    """The whole JSON dump, serialised and compressed ahead of time."""
+
+    # Content-Encoding -> body, "identity" being the uncompressed one.
+    bodies: dict[str, bytes]
+    # Content-Encoding -> ETag, which has to differ between encodings.
+    etags: dict[str, str]
+    created: float
+
+
+def _compress(body: bytes) -> dict[str, bytes]:
+    bodies = {"identity": body, "gzip": gzip.compress(body, compresslevel=9)}
+    if brotli is not None:
+        bodies["br"] = brotli.compress(body)
+    return bodies
+
+
+def _accepted_encodings(accept_encoding: str | None) -> set[str]:
+    accepted = set()
+    for item in (accept_encoding or "").split(","):
+        encoding, *params = item.split(";")
+        refused = False
+        for param in params:
+            name, _, value = param.strip().partition("=")
+            with contextlib.suppress(ValueError):
+                refused |= name == "q" and float(value) == 0
+        if encoding.strip() and not refused:
+            accepted.add(encoding.strip().lower())
+    return accepted
+
+
+def _etag_matches(etag: str, if_none_match: str | None) -> bool:
+    if not if_none_match:
+        return False
+    tags = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+    return "*" in tags or etag in tags
+
+
+def _parse_paging(value: str | None, name: str) -> int | None:
+    if value is None or value == "":
+        return None
+    if not value.isdigit():
+        raise ValueError(f"{name} must be a non-negative integer.")
+    return int(value)
 
 
 @irc3.plugin
 class UserDB(Plugin):
     def __init__(self, bot):
         super().__init__(bot)
+        # Lowercased nick -> that user's row as a dict, or None if there isn't one.
+        self._cache = LRUCache(
+            __name__,
+            int(self.config.get("cache_size", 1024)),
+            float(self.config.get("cache_ttl", 300)),
+        )
+        # Lowercased nick -> reads of that user's row after a cache miss. A read
+        # which raced a write would cache an older row over the new one.
+        self._reads: dict[str, _Reads] = {}
+
+        # The unpaged dump is served from memory and rebuilt in the background,
+        # snapshot_debounce seconds after a user's values change.
+        self._snapshot: _Snapshot | None = None
+        self._snapshot_lock = asyncio.Lock()
+        self._snapshot_task: asyncio.Task | None = None
+        self._snapshot_dirty = False
+        self._snapshot_debounce = float(self.config.get("snapshot_debounce", 5))
+        # Only last_seen changes otherwise, so refresh that now and then.
+        self._snapshot_max_age = float(self.config.get("snapshot_max_age", 300))
+
+        # Replaced every time it's set, so that everyone waiting on it wakes up.
+        self._changed = asyncio.Event()
+        # Changes are only served once they're this many seconds old, see
+        # _changed_users().
+        self._changes_delay = float(self.config.get("changes_delay", 5))
 
         if self.config.get("enable_http_server", False):
-            host = self.config.get("http_host", "127.0.0.1")
-            port = int(self.config.get("http_port", 8080))
-            bottle.hook("before_request")(_strip_path)
-            bottle.route("/")(self._json_dump)
-            bottle_thread = threading.Thread(
-                target=bottle.run,
-                kwargs={"quiet": True, "host": host, "port": port},
-                name=f"{__name__} HTTP server",
-                daemon=True,
-            )
-            bottle_thread.start()
+            # Only listen when there's something to serve, not for every bot.
+            if "cappuccino.httpserver" not in self.bot.registry.includes:
+                self.bot.include("cappuccino.httpserver")
+            self.bot.add_route("/", self._json_dump)
+            self.bot.add_route("/changes", self._changes)
+            self.bot.add_route("/search", self._search)
+
+    def _cache_written(self, username: str, row):
+        """Caches a row just written, or forgets the user's row if it's MISSING."""
+        nick = username.lower()
+        if (reads := self._reads.get(nick)) is not None:
+            reads.writes += 1
+        if row is MISSING:
+            self._cache.pop(nick)
+        else:
+            self._cache.set(nick, row)
+
+    @contextlib.contextmanager
+    def _reading(self, username: str):
+        """Tracks a read of the user's row, yields a function telling whether the
+        user has been written since it started.
+        """
+        nick = username.lower()
+        reads = self._reads.setdefault(nick, _Reads())
+        reads.count += 1
+        writes = reads.writes
+        try:
+            yield lambda: reads.writes == writes
+        finally:
+            reads.count -= 1
+            if not reads.count:
+                del self._reads[nick]
+
+    def _cache_row(
+        self, username: str, row, unwritten: Callable[[], bool] | None = None
+    ) -> dict | None:
+        """Caches a row, unless it was read while the user was being written."""
+        row = row._asdict() if row is not None else None
+        if unwritten is None:
+            self._cache_written(username, row)
+        elif unwritten():
+            self._cache.set(username.lower(), row)
+        return row
 
     @irc3.extend
-    def get_user_value(self, username: str, key: str):
-        with self.db_session() as session:
-            return session.scalar(
-                select(RiceDB.__table__.columns[key]).where(
-                    func.lower(RiceDB.nick) == username.lower()
+    def get_user_values(self, username: str, keys: Iterable[str]) -> dict:
+        """Returns a dict of the user's values for each of keys, None if unset."""
+        row = self._cache.get(username.lower())
+        if row is MISSING:
+            with self._reading(username) as unwritten, self.db_session() as session:
+                row = self._cache_row(
+                    username,
+                    session.execute(_select_user(username)).first(),
+                    unwritten,
                 )
-            )
+        return _user_values(row, keys)
+
+    @irc3.extend
+    async def async_get_user_values(self, username: str, keys: Iterable[str]) -> dict:
+        row = self._cache.get(username.lower())
+        if row is MISSING:
+            with self._reading(username) as unwritten:
+                async with self.async_db_session() as session:
+                    result = await session.execute(_select_user(username))
+                    row = self._cache_row(username, result.first(), unwritten)
+        return _user_values(row, keys)
+
+    @irc3.extend
+    def get_user_value(self, username: str, key: str):
+        return self.get_user_values(username, [key])[key]
+
+    @irc3.extend
+    async def async_get_user_value(self, username: str, key: str):
+        return (await self.async_get_user_values(username, [key]))[key]
+
+    @irc3.extend
+    def cache_user_value(self, username: str, key: str, value=None):
+        """Updates the cached copy of a value another plugin saved itself."""
+        row = self._cache.peek(username.lower())
+        if row is MISSING or row is None:
+            # Its other columns may have just been given their defaults.
+            self._cache_written(username, MISSING)
+        else:
+            self._cache_written(username, row | {key: copy.deepcopy(value)})
+        # Seen leaves updated_at alone, so there's nothing new in /changes.
+        if key != "last_seen":
+            self._notify_changed()
 
     @irc3.extend
     def del_user_value(self, username: str, key: str):
         self.set_user_value(username, key, None)
 
+    @irc3.extend
+    def set_user_values(self, username: str, values: dict):
+        """Sets several of the user's values at once, creating the user if needed."""
+        if not values:
+            return
+
+        with self.db_session.begin() as session:
+            row = session.execute(_upsert_values(username, values)).one()
+        self._cache_row(username, row)
+        self._values_changed(values)
+
+    @irc3.extend
+    async def async_set_user_values(self, username: str, values: dict):
+        if not values:
+            return
+
+        async with self.async_db_session.begin() as session:
+            row = (await session.execute(_upsert_values(username, values))).one()
+        self._cache_row(username, row)
+        self._values_changed(values)
+
     @irc3.extend
     def set_user_value(self, username: str, key: str, value=None):
-        with self.db_session() as session:
-            user = session.scalar(
-                update(RiceDB)
-                .returning(RiceDB)
-                .where(func.lower(RiceDB.nick) == username.lower())
-                .values({key: value})
-            )
+        self.set_user_values(username, {key: value})
+
+    @irc3.extend
+    async def async_set_user_value(self, username: str, key: str, value=None):
+        await self.async_set_user_values(username, {key: value})
+
+    def _modify_list(self, username: str, key: str, statement) -> tuple | None:
+        with self.db_session.begin() as session:
+            row = session.execute(statement).first()
+        if row is None:
+            return None
+
+        *values, result = row
+        row = dict(zip(row._fields, values, strict=False))
+        self._cache_written(username, row)
+        self._values_changed({key: row[key]})
+        return row[key], result
+
+    @irc3.extend
+    def add_user_list_values(
+        self, username: str, key: str, entries: list, max_entries: int
+    ) -> list | None:
+        """Appends entries to one of the user's lists in a single statement.
 
-            if user is None:
-                user = RiceDB(nick=username, **{key: value})
-                session.add(user)
+        Returns the new list, or None if it would have more than max_entries.
+        """
+        if len(entries) > max_entries:
+            return None
 
-    def _json_dump(self):
-        bottle.response.content_type = "application/json"
+        with self.db_session.begin() as session:
+            row = session.execute(
+                _append_entries(username, key, entries, max_entries)
+            ).first()
+        if row is None:
+            return None
+
+        self._cache_row(username, row)
+        self._values_changed({key: entries})
+        return _user_values(row._asdict(), [key])[key]
+
+    @irc3.extend
+    def delete_user_list_values(
+        self, username: str, key: str, indexes: list[int]
+    ) -> tuple[list, list] | None:
+        """Removes the entries at indexes from one of the user's lists.
+
+        Returns the new list and the removed entries, or None if nothing was removed.
+        """
+        return self._modify_list(username, key, _delete_entries(username, key, indexes))
+
+    @irc3.extend
+    def replace_user_list_value(
+        self, username: str, key: str, index: int, entry: str
+    ) -> tuple[list, str] | None:
+        """Replaces the entry at index in one of the user's lists.
+
+        Returns the new list and the replaced entry, or None if there wasn't one.
+        """
+        return self._modify_list(
+            username, key, _replace_entry(username, key, index, entry)
+        )
+
+    @irc3.extend
+    def search_users(
+        self, term: str, limit: int, offset: int = 0
+    ) -> list[tuple[str, dict[str, list[tuple[int, str]]]]]:
+        """Finds the users with list entries containing term, best matches first.
+
+        Returns each user's nick and their matching entries, with their indexes,
+        by list. Raises ValueError if term is too short to search for.
+        """
+        term = _search_term(term)
 
-        data = []
         with self.db_session() as session:
-            all_users = session.scalars(
-                select(RiceDB).order_by(nullslast(desc(RiceDB.last_seen)))
-            ).all()
-
-        for user in all_users:
-            user_dict = {}
-            for column, value in inspect(user).attrs.items():
-                value = value.value
-                if value is None:
-                    continue
-
-                if column == "last_seen":
-                    value = value.timestamp()
-
-                with contextlib.suppress(TypeError, AttributeError):
-                    value = (
-                        [unstyle(val) for val in value]
-                        if isinstance(value, list)
-                        else unstyle(value)
+            rows = session.execute(_search_users(term, limit, offset)).all()
+        return [(row.nick, _matching_entries(row, term)) for row in rows]
+
+    @irc3.extend
+    async def async_search_users(
+        self, term: str, limit: int, offset: int = 0
+    ) -> list[tuple[str, dict[str, list[tuple[int, str]]]]]:
+        term = _search_term(term)
+
+        async with self.async_db_session() as session:
+            rows = (await session.execute(_search_users(term, limit, offset))).all()
+        return [(row.nick, _matching_entries(row, term)) for row in rows]
+
+    def _values_changed(self, values: dict):
+        self._notify_changed()
+        # Not worth rebuilding for last_seen, or before anyone wants the dump.
+        if self._snapshot is not None and values.keys() - {"last_seen"}:
+            self._snapshot_changed()
+
+    def _notify_changed(self):
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    def _snapshot_changed(self):
+        self._snapshot_dirty = True
+        if self._snapshot_task is None or self._snapshot_task.done():
+            self._snapshot_task = self.bot.create_task(self._refresh_snapshot())
+
+    async def _refresh_snapshot(self):
+        # Anything else that changes while we wait is picked up by the same rebuild.
+        while self._snapshot_dirty:
+            await asyncio.sleep(self._snapshot_debounce)
+            self._snapshot_dirty = False
+            try:
+                async with self._snapshot_lock:
+                    await self._build_snapshot()
+            except Exception:
+                self.logger.exception("Couldn't rebuild the JSON dump.")
+
+    async def _build_snapshot(self):
+        dump = self._dump_users(_users_page(None, None))
+        etag = await anext(dump)
+        body = b"".join([chunk async for chunk in dump])
+        bodies = await self.run_blocking(_compress, body)
+        etags = {
+            encoding: etag if encoding == "identity" else f'{etag[:-1]}-{encoding}"'
+            for encoding in bodies
+        }
+        self._snapshot = _Snapshot(bodies, etags, time.monotonic())
+
+    async def _get_snapshot(self) -> _Snapshot:
+        if self._snapshot is None:
+            # Only the first request builds it, any others wait for that one.
+            async with self._snapshot_lock:
+                if self._snapshot is None:
+                    await self._build_snapshot()
+        elif time.monotonic() - self._snapshot.created > self._snapshot_max_age:
+            # Serve this one while a fresh one is built.
+            self._snapshot_changed()
+        return self._snapshot
+
+    async def _snapshot_response(self, request: Request) -> Response:
+        snapshot = await self._get_snapshot()
+        accepted = _accepted_encodings(request.headers.get("accept-encoding"))
+        encoding = next(
+            (e for e in ("br", "gzip") if e in snapshot.bodies and e in accepted),
+            "identity",
+        )
+
+        headers = {"ETag": snapshot.etags[encoding], "Vary": "Accept-Encoding"}
+        if encoding != "identity":
+            headers["Content-Encoding"] = encoding
+        if _etag_matches(headers["ETag"], request.headers.get("if-none-match")):
+            return Response(status=HTTPStatus.NOT_MODIFIED, headers=headers)
+
+        return Response(
+            snapshot.bodies[encoding], content_type="application/json", headers=headers
+        )
+
+    async def _json_dump(self, request: Request) -> Response:
+        try:
+            limit = _parse_paging(request.query.get("limit"), "limit")
+            offset = _parse_paging(request.query.get("offset"), "offset")
+        except ValueError as exc:
+            raise HTTPError(HTTPStatus.BAD_REQUEST, str(exc)) from None
+
+        if limit is None and offset is None:
+            return await self._snapshot_response(request)
+
+        dump = self._dump_users(_users_page(limit, offset))
+        etag = await anext(dump)
+        headers = {"ETag": etag}
+        if _etag_matches(etag, request.headers.get("if-none-match")):
+            await dump.aclose()
+            return Response(status=HTTPStatus.NOT_MODIFIED, headers=headers)
+
+        # A client too slow to read it is dropped by the server, which closes
+        # the session and gives its connection back.
+        return Response(dump, content_type="application/json", headers=headers)
+
+    async def _changes(self, request: Request) -> Response:
+        """Users changed after a cursor, or a Unix timestamp, oldest first.
+
+        With wait, waits up to that many seconds for a change if there are none yet.
+        """
+        try:
+            if "cursor" in request.query:
+                after = _decode_cursor(request.query["cursor"])
+            else:
+                since = request.query.get("since")
+                after = (
+                    _parse_since(since) if since else datetime.min.replace(tzinfo=UTC),
+                    "",
+                )
+            limit = _parse_paging(request.query.get("limit"), "limit") or _CHANGES_LIMIT
+            wait = _parse_paging(request.query.get("wait"), "wait") or 0
+        except ValueError as exc:
+            raise HTTPError(HTTPStatus.BAD_REQUEST, str(exc)) from None
+
+        limit = min(limit, _CHANGES_MAX_LIMIT)
+        deadline = time.monotonic() + min(wait, _CHANGES_MAX_WAIT)
+        while True:
+            # Taken before querying so a change made meanwhile isn't missed.
+            changed = self._changed
+            async with self.async_db_session() as session:
+                rows = (
+                    await session.execute(
+                        _changed_users(after, limit, self._changes_delay)
                     )
+                ).all()
+
+            remaining = deadline - time.monotonic()
+            if rows or remaining <= 0:
+                break
+            # Changes made by anything else don't wake us, so look again anyway.
+            with contextlib.suppress(TimeoutError):
+                async with asyncio.timeout(min(remaining, 5)):
+                    await changed.wait()
+                    # It won't be served until it's old enough.
+                    await asyncio.sleep(self._changes_delay)
+
+        if rows:
+            after = rows[-1].updated_at, rows[-1].nick
+        users = ",".join(row[0] for row in rows)
+        cursor = json.dumps(_encode_cursor(*after))
+        return Response(
+            f'{{"users":[{users}],"cursor":{cursor}}}',
+            content_type="application/json",
+        )
+
+    async def _search(self, request: Request) -> Response:
+        """Users with entries containing q, best matches first, and their matches."""
+        try:
+            limit = _parse_paging(request.query.get("limit"), "limit") or _SEARCH_LIMIT
+            offset = _parse_paging(request.query.get("offset"), "offset") or 0
+            limit = min(limit, _SEARCH_MAX_LIMIT)
+            # One more than asked for, to tell whether there's another page.
+            results = await self.async_search_users(
+                request.query.get("q", ""), limit + 1, offset
+            )
+        except ValueError as exc:
+            raise HTTPError(HTTPStatus.BAD_REQUEST, str(exc)) from None
 
-                user_dict[column] = value
-            data.append(user_dict)
-        return json.dumps(data)
+        users = [
+            {
+                "nick": unstyle(nick),
+                "matches": {
+                    key: [unstyle(entry) for _, entry in entries]
+                    for key, entries in matches.items()
+                },
+            }
+            for nick, matches in results[:limit]
+        ]
+        next_offset = offset + limit if len(results) > limit else None
+        return Response(
+            json.dumps({"users": users, "next_offset": next_offset}),
+            content_type="application/json",
+        )
+
+    async def _dump_users(self, users):
+        """Yields the ETag for users, then their JSON in chunks."""
+        async with self.async_db_session() as session:
+            # The ETag has to describe exactly what gets streamed afterwards.
+            await session.connection(
+                execution_options={"isolation_level": "REPEATABLE READ"}
+            )
+            yield f'"{await session.scalar(_users_etag(users))}"'
+
+            result = await session.stream(
+                select(_user_json(users))
+                .select_from(users)
+                .order_by(*_users_order(users.c))
+            )
+            yield b"["
+            separator = b""
+            async for batch in result.scalars().partitions(_STREAM_BATCH_SIZE):
+                yield separator + ",".join(batch).encode("UTF-8")
+                separator = b","
+            yield b"]"
@@ -0,0 +1,124 @@
+#  This file is part of cappuccino.
+#
+#  cappuccino is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  cappuccino is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with cappuccino.  If not, see <https://www.gnu.org/licenses/>.
+
+import threading
+import time
+from collections import OrderedDict
+from typing import TYPE_CHECKING
+
+from cappuccino.util.metrics import CACHE_REQUESTS
+
+if TYPE_CHECKING:
+    from collections.abc import Callable
+
+# Returned by LRUCache.get() for keys it doesn't have, since None is a valid value.
+MISSING = object()
+
+
+class LRUCache:
+    """A thread-safe cache which evicts the least recently used entry once full.
+
+    Entries also expire ttl seconds after they were set, if ttl is given.
+    A maxsize of 0 disables the cache, every get() is a miss.
+
+    With weigh, maxsize limits the total of weigh(value) for every entry rather
+    than how many there are. Values are weighed when they're set.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        maxsize: int,
+        ttl: float | None = None,
+        weigh: Callable[[object], int] | None = None,
+    ):
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._weigh = weigh or (lambda _: 1)
+        self._size = 0
+        # key -> (expiry time, value, weight)
+        self._entries: OrderedDict[object, tuple[float, object, int]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def size(self) -> int:
+        """The total weight of every entry, or how many there are without weigh."""
+        return self._size
+
+    def _remove(self, key):
+        _, _, weight = self._entries.pop(key)
+        self._size -= weight
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] < time.monotonic():
+                self._remove(key)
+                entry = None
+
+            if entry is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self._entries.move_to_end(key)
+
+        CACHE_REQUESTS.inc(cache=self.name, result="miss" if entry is None else "hit")
+        return MISSING if entry is None else entry[1]
+
+    def peek(self, key):
+        """Like get(), but doesn't count as a use of the entry or as a hit or miss."""
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is None or entry[0] < time.monotonic():
+            return MISSING
+        return entry[1]
+
+    def set(self, key, value):
+        if self.maxsize <= 0:
+            return
+
+        expires = time.monotonic() + self.ttl if self.ttl else float("inf")
+        weight = self._weigh(value)
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (expires, value, weight)
+            self._size += weight
+            # The newest entry stays, even if it's heavier than maxsize alone.
+            while self._size > self.maxsize and len(self._entries) > 1:
+                self._remove(next(iter(self._entries)))
+
+    def pop(self, key):
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+
+    def expire(self):
+        """Drops expired entries now, rather than when they're next asked for."""
+        now = time.monotonic()
+        with self._lock:
+            for key in [key for key, entry in self._entries.items() if entry[0] < now]:
+                self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
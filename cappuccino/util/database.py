@@ -0,0 +1,377 @@
+#  This file is part of cappuccino.
+#
+#  cappuccino is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  cappuccino is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with cappuccino.  If not, see <https://www.gnu.org/licenses/>.
+
+import asyncio
+import threading
+import time
+from dataclasses import dataclass, field
+
+from sqlalchemy import create_engine, event, exc
+from sqlalchemy.ext.asyncio import (
+    AsyncSession,
+    AsyncSessionTransaction,
+    async_sessionmaker,
+    create_async_engine,
+)
+from sqlalchemy.orm import Session, sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+
+from cappuccino.util.metrics import DB_QUERIES, DB_QUERY_DURATION, current_plugin
+
+_DEFAULT_MAX_CONNECTIONS = 10
+_DEFAULT_POOL_TIMEOUT = 30
+
+
+class _WaitStats:
+    """Thread-safe accumulator for time spent waiting on a connection."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, duration: float):
+        with self._lock:
+            self.count += 1
+            self.total += duration
+            self.max = max(self.max, duration)
+
+
+class _TimedPoolMixin:
+    """Records how long each pool checkout waited for a connection."""
+
+    wait_stats: _WaitStats | None = None
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            if self.wait_stats is not None:
+                self.wait_stats.record(time.perf_counter() - start)
+
+
+class _TimedQueuePool(_TimedPoolMixin, QueuePool):
+    pass
+
+
+class _TimedAsyncQueuePool(_TimedPoolMixin, AsyncAdaptedQueuePool):
+    pass
+
+
+def _instrument_engine(engine, name: str):
+    """Counts and times every query run through engine, per plugin."""
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def before_cursor_execute(conn, *_):
+        conn.info.setdefault("query_start_time", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after_cursor_execute(conn, _cursor, statement, *_):
+        duration = time.perf_counter() - conn.info["query_start_time"].pop()
+        plugin = current_plugin.get()
+        DB_QUERIES.inc(
+            plugin=plugin, engine=name, statement=statement.split(None, 1)[0].upper()
+        )
+        DB_QUERY_DURATION.observe(duration, plugin=plugin, engine=name)
+
+    @event.listens_for(engine, "handle_error")
+    def handle_error(context):
+        if start_times := context.connection.info.get("query_start_time"):
+            start_times.pop()
+
+
+class _CheckoutLimiter:
+    """Caps how many sessions a single plugin may hold open at once."""
+
+    def __init__(self, name: str, limit: int, timeout: float):
+        self.name = name
+        self.limit = limit
+        self.checked_out = 0
+        self.wait_stats = _WaitStats()
+        self._timeout = timeout
+        self._semaphore = threading.BoundedSemaphore(limit)
+        self._lock = threading.Lock()
+
+    def _timeout_error(self) -> exc.TimeoutError:
+        return exc.TimeoutError(
+            f"{self.name} has reached its limit of {self.limit} database"
+            f" connections, timed out after {self._timeout} seconds."
+        )
+
+    def acquire(self):
+        start = time.perf_counter()
+        acquired = self._semaphore.acquire(timeout=self._timeout)
+        self.wait_stats.record(time.perf_counter() - start)
+        if not acquired:
+            raise self._timeout_error()
+
+        with self._lock:
+            self.checked_out += 1
+
+    def release(self):
+        with self._lock:
+            self.checked_out -= 1
+        self._semaphore.release()
+
+
+class _AsyncCheckoutLimiter(_CheckoutLimiter):
+    """The asyncio counterpart to _CheckoutLimiter, waits without blocking the loop."""
+
+    def __init__(self, name: str, limit: int, timeout: float):
+        super().__init__(name, limit, timeout)
+        self._semaphore = asyncio.BoundedSemaphore(limit)
+
+    async def acquire(self):
+        start = time.perf_counter()
+        try:
+            async with asyncio.timeout(self._timeout):
+                await self._semaphore.acquire()
+        except TimeoutError:
+            raise self._timeout_error() from None
+        finally:
+            self.wait_stats.record(time.perf_counter() - start)
+
+        self.checked_out += 1
+
+    def release(self):
+        self.checked_out -= 1
+        self._semaphore.release()
+
+
+class PluginSession(Session):
+    """A Session which holds one of its plugin's checkout slots until closed."""
+
+    def __init__(self, *args, limiter: _CheckoutLimiter, **kwargs):
+        limiter.acquire()
+        self._limiter: _CheckoutLimiter | None = limiter
+        try:
+            super().__init__(*args, **kwargs)
+        except BaseException:
+            self._release_limiter()
+            raise
+
+    def _release_limiter(self):
+        limiter, self._limiter = self._limiter, None
+        if limiter is not None:
+            limiter.release()
+
+    def close(self):
+        try:
+            super().close()
+        finally:
+            self._release_limiter()
+
+
+class _PluginSessionTransaction(AsyncSessionTransaction):
+    """Takes its session's checkout slot, if it hasn't one yet, before beginning."""
+
+    async def start(self, is_ctxmanager: bool = False):  # noqa: FBT001, FBT002
+        acquired = await self.session._acquire_slot()  # noqa: SLF001
+        try:
+            return await super().start(is_ctxmanager)
+        except BaseException:
+            if acquired:
+                self.session._release_slot()  # noqa: SLF001
+            raise
+
+
+class AsyncPluginSession(AsyncSession):
+    """An AsyncSession which holds one of its plugin's checkout slots while open.
+
+    The slot is taken when the session is entered with ``async with``, or when a
+    transaction is begun on it, which async_sessionmaker.begin() does without
+    entering the session itself.
+    """
+
+    def __init__(self, *args, limiter: _AsyncCheckoutLimiter, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._limiter = limiter
+        self._holds_slot = False
+
+    async def _acquire_slot(self) -> bool:
+        """Takes a checkout slot, returns whether it didn't already have one."""
+        if self._holds_slot:
+            return False
+        await self._limiter.acquire()
+        self._holds_slot = True
+        return True
+
+    def _release_slot(self):
+        if self._holds_slot:
+            self._holds_slot = False
+            self._limiter.release()
+
+    async def __aenter__(self):
+        await self._acquire_slot()
+        return await super().__aenter__()
+
+    def begin(self) -> AsyncSessionTransaction:
+        return _PluginSessionTransaction(self)
+
+    async def close(self):
+        try:
+            await super().close()
+        finally:
+            self._release_slot()
+
+
+@dataclass(frozen=True)
+class PoolStats:
+    size: int
+    max_connections: int
+    checked_out: int
+    overflow: int
+    checkouts: int
+    wait_time_total: float
+    wait_time_max: float
+    plugins: dict[str, int] = field(default_factory=dict)
+
+    @property
+    def wait_time_avg(self) -> float:
+        return self.wait_time_total / self.checkouts if self.checkouts else 0.0
+
+
+def _pool_options(budget: int, pool_size: int | None, timeout: float) -> dict:
+    pool_size = max(1, min(pool_size or (budget + 1) // 2, budget))
+    return {
+        "pool_size": pool_size,
+        "max_overflow": budget - pool_size,
+        "pool_timeout": timeout,
+    }
+
+
+def _pool_stats(pool, budget: int, limiters: dict[str, _CheckoutLimiter]) -> PoolStats:
+    wait_stats = pool.wait_stats
+    return PoolStats(
+        size=pool.size(),
+        max_connections=budget,
+        checked_out=pool.checkedout(),
+        overflow=max(0, pool.overflow()),
+        checkouts=wait_stats.count,
+        wait_time_total=wait_stats.total,
+        wait_time_max=wait_stats.max,
+        plugins={name: limiter.checked_out for name, limiter in limiters.items()},
+    )
+
+
+class Database:
+    """Engines and a connection budget shared by every plugin using one database.
+
+    The budget (max_connections) is split between a synchronous engine and an
+    AsyncEngine, async_max_connections of it going to the latter.
+    """
+
+    def __init__(self, db_config: dict):
+        uri = db_config.get("uri")
+        pool_size = int(db_config["pool_size"]) if "pool_size" in db_config else None
+        if "max_connections" in db_config or "max_overflow" not in db_config:
+            max_connections = int(
+                db_config.get("max_connections", _DEFAULT_MAX_CONNECTIONS)
+            )
+        else:
+            max_connections = (pool_size or 1) + int(db_config["max_overflow"])
+
+        # Each engine needs at least one connection.
+        self.max_connections = max(2, max_connections)
+        self.async_max_connections = max(
+            1,
+            min(
+                int(db_config.get("async_max_connections", self.max_connections // 2)),
+                self.max_connections - 1,
+            ),
+        )
+        self.sync_max_connections = self.max_connections - self.async_max_connections
+        self.plugin_max_connections = int(
+            db_config.get("plugin_max_connections", max(1, self.max_connections // 2))
+        )
+        self.pool_timeout = float(db_config.get("pool_timeout", _DEFAULT_POOL_TIMEOUT))
+
+        self.engine = create_engine(
+            uri,
+            poolclass=_TimedQueuePool,
+            **_pool_options(self.sync_max_connections, pool_size, self.pool_timeout),
+        )
+        self.engine.pool.wait_stats = _WaitStats()
+        _instrument_engine(self.engine, "sync")
+
+        # psycopg's dialect transparently switches to its async variant here.
+        self.async_engine = create_async_engine(
+            uri,
+            poolclass=_TimedAsyncQueuePool,
+            **_pool_options(self.async_max_connections, pool_size, self.pool_timeout),
+        )
+        self.async_engine.pool.wait_stats = _WaitStats()
+        _instrument_engine(self.async_engine.sync_engine, "async")
+
+        self._limiters: dict[str, _CheckoutLimiter] = {}
+        self._async_limiters: dict[str, _AsyncCheckoutLimiter] = {}
+        self._limiters_lock = threading.Lock()
+
+    def _get_limiter(
+        self,
+        limiters: dict,
+        limiter_class: type[_CheckoutLimiter],
+        name: str,
+        limit: int | None = None,
+    ):
+        with self._limiters_lock:
+            if name not in limiters:
+                limit = min(limit or self.plugin_max_connections, self.max_connections)
+                limiters[name] = limiter_class(name, limit, self.pool_timeout)
+            return limiters[name]
+
+    def session_factory(self, name: str, limit: int | None = None) -> sessionmaker:
+        """Returns a session factory whose sessions count against name's limit."""
+        limiter = self._get_limiter(self._limiters, _CheckoutLimiter, name, limit)
+        return sessionmaker(self.engine, class_=PluginSession, limiter=limiter)
+
+    def async_session_factory(
+        self, name: str, limit: int | None = None
+    ) -> async_sessionmaker:
+        """Returns an AsyncSession factory whose sessions count against name's limit."""
+        limiter = self._get_limiter(
+            self._async_limiters, _AsyncCheckoutLimiter, name, limit
+        )
+        return async_sessionmaker(
+            self.async_engine,
+            class_=AsyncPluginSession,
+            expire_on_commit=False,
+            limiter=limiter,
+        )
+
+    def stats(self) -> dict[str, PoolStats]:
+        return {
+            "sync": _pool_stats(
+                self.engine.pool, self.sync_max_connections, self._limiters
+            ),
+            "async": _pool_stats(
+                self.async_engine.pool, self.async_max_connections, self._async_limiters
+            ),
+        }
+
+
+_databases: dict[tuple, Database] = {}
+_databases_lock = threading.Lock()
+
+
+def get_database(db_config: dict) -> Database:
+    """Returns the process-wide Database for db_config, creating it if needed."""
+    key = tuple(sorted((k, v) for k, v in db_config.items() if k not in ("#", "hash")))
+    with _databases_lock:
+        if key not in _databases:
+            _databases[key] = Database(db_config)
+        return _databases[key]
@@ -0,0 +1,217 @@
+#  This file is part of cappuccino.
+#
+#  cappuccino is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  cappuccino is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with cappuccino.  If not, see <https://www.gnu.org/licenses/>.
+
+"""Skips event regexes which can't possibly match a line.
+
+irc3 tries every event regex against every line it sends or receives, so each
+@irc3.event handler adds to the cost of every message. Most of those regexes
+require some literal text (" PRIVMSG ", "wew", "NickServ!"...), so one combined
+search for all of them tells us which regexes are worth running at all.
+"""
+
+import re
+from re import _constants as sre
+from re import _parser as sre_parse
+from re._casefix import _EXTRA_CASES
+
+# Shorter literals are in nearly every line and would only slow the search down.
+_MIN_KEYWORD_LENGTH = 3
+_REPEATS = {sre.MAX_REPEAT, sre.MIN_REPEAT, sre.POSSESSIVE_REPEAT}
+
+
+def _end_run(run: list[str], keywords: set[str]):
+    # Surrounding spaces only make keywords overlap more, see _keywords_in().
+    keyword = "".join(run).strip().lower()
+    if len(keyword) >= _MIN_KEYWORD_LENGTH:
+        keywords.add(keyword)
+    run.clear()
+
+
+def _is_keyword_char(char: str, flags: int) -> bool:
+    """Whether everything re matches char against lowercases to char.lower().
+
+    Lines are lowercased with str.lower(), but re folds case one character at a
+    time and with extra equivalences, so "same" matches "\u017fame" when ignoring
+    case. Characters like that can't be part of a keyword.
+    """
+    lowered = char.lower()
+    # "\u0130" lowercases to two characters, and a final sigma depends on what
+    # follows it.
+    if len(lowered) != 1 or char == "\u03a3":
+        return False
+    if not flags & re.IGNORECASE or flags & re.ASCII:
+        return True
+    # "i" also matches "\u0130", which str.lower() gives a combining dot.
+    return lowered != "i" and ord(lowered) not in _EXTRA_CASES
+
+
+def _literal(av: int, run: list[str], keywords: set[str], flags: int):
+    if _is_keyword_char(chr(av), flags):
+        run.append(chr(av))
+    else:
+        _end_run(run, keywords)
+
+
+def _walk_repeat(repeat, run: list[str], keywords: set[str], flags: int):
+    minimum, maximum, item = repeat
+    if len(item) == 1 and item[0][0] is sre.LITERAL:
+        # ayy+ still needs "ayy".
+        for _ in range(minimum):
+            _literal(item[0][1], run, keywords, flags)
+        if maximum != minimum:
+            _end_run(run, keywords)
+        return
+
+    # The first repetition is required, but it doesn't join up with whatever
+    # comes before or after it.
+    _end_run(run, keywords)
+    _walk(item, run, keywords, flags)
+    _end_run(run, keywords)
+
+
+def _walk(items, run: list[str], keywords: set[str], flags: int):
+    for op, av in items:
+        if op is sre.LITERAL:
+            _literal(av, run, keywords, flags)
+        elif op is sre.SUBPATTERN:
+            # (?i:...) and (?-i:...) change the flags for just this group.
+            _, add_flags, del_flags, group = av
+            _walk(group, run, keywords, (flags | add_flags) & ~del_flags)
+        elif op is sre.ATOMIC_GROUP:
+            _walk(av, run, keywords, flags)
+        elif op in _REPEATS and av[0] >= 1:
+            _walk_repeat(av, run, keywords, flags)
+        else:
+            # Anything else could match different text, so the literal ends here.
+            _end_run(run, keywords)
+
+
+def required_keywords(pattern: re.Pattern) -> frozenset[str]:
+    """Returns the lowercased literals every match of pattern must contain.
+
+    Only characters which lowercase the same way everything they match does are
+    used, so a line re would match always contains them once lowercased.
+    """
+    keywords = set()
+    run = []
+    try:
+        parsed = sre_parse.parse(pattern.pattern, pattern.flags)
+        # Includes any global inline flags, like (?i) at the start.
+        _walk(parsed, run, keywords, parsed.state.flags)
+    except (re.error, TypeError):
+        return frozenset()
+
+    _end_run(run, keywords)
+    return frozenset(keywords)
+
+
+def _can_straddle(keyword: str, other: str) -> bool:
+    """Whether other can start inside keyword and carry on past its end."""
+    return any(
+        other.startswith(keyword[start:]) and len(other) > len(keyword) - start
+        for start in range(1, len(keyword))
+    )
+
+
+class EventPrefilter:
+    """Replaces Registry.get_event_matches with one that skips hopeless regexes."""
+
+    def __init__(self, registry):
+        self._registry = registry
+        self._keywords: dict[re.Pattern, frozenset[str]] = {}
+        # Keyword -> every keyword that's part of it, and so is also in the line.
+        self._contained: dict[str, frozenset[str]] = {}
+        # Keywords which another keyword might overlap the end of.
+        self._straddled: frozenset[str] = frozenset()
+        self._search: re.Pattern | None = None
+        # Per iotype, the events_re list each plan was made from and its length
+        # at the time. irc3 only ever appends to it or replaces it.
+        self._plans: dict[str, tuple[list, int, list]] = {}
+
+    def _pattern_keywords(self, cregexp) -> frozenset[str]:
+        # irc3 stores the bound match() of each compiled regex.
+        pattern = getattr(cregexp, "__self__", None)
+        if not isinstance(pattern, re.Pattern):
+            return frozenset()
+
+        if (keywords := self._keywords.get(pattern)) is None:
+            keywords = self._keywords[pattern] = required_keywords(pattern)
+            if not keywords <= self._contained.keys():
+                self._add_keywords(keywords)
+
+        return keywords
+
+    def _add_keywords(self, keywords: frozenset[str]):
+        known = self._contained.keys() | keywords
+        self._contained = {
+            keyword: frozenset(other for other in known if other in keyword)
+            for keyword in known
+        }
+        self._straddled = frozenset(
+            keyword
+            for keyword in known
+            if any(_can_straddle(keyword, other) for other in known)
+        )
+        # Longest first, so the only keywords a match can hide are part of it.
+        # Matching lowercased lines case-sensitively lets re skip ahead quickly.
+        alternation = "|".join(
+            re.escape(keyword) for keyword in sorted(known, key=len, reverse=True)
+        )
+        self._search = re.compile(alternation)
+
+    def _plan(self, iotype: str) -> list[tuple[str, object, frozenset[str]]]:
+        events_re = self._registry.events_re[iotype]
+        source, length, plan = self._plans.get(iotype, (None, 0, []))
+        if source is not events_re or length != len(events_re):
+            plan = [
+                (regexp, cregexp, self._pattern_keywords(cregexp))
+                for regexp, cregexp in events_re
+            ]
+            self._plans[iotype] = (events_re, len(events_re), plan)
+        return plan
+
+    def _keywords_in(self, data: str) -> set[str]:
+        data = data.lower()
+        found = set()
+        position = 0
+        while match := self._search.search(data, position):
+            keyword = match.group()
+            found |= self._contained[keyword]
+            # Search again from just inside the match if another keyword could
+            # overlap its end, rather than from after it.
+            position = match.start() + 1 if keyword in self._straddled else match.end()
+        return found
+
+    def get_event_matches(self, data: str, iotype: str = "in"):
+        events = self._registry.events[iotype]
+        found = None
+        for regexp, cregexp, keywords in self._plan(iotype):
+            if keywords:
+                if found is None:
+                    found = self._keywords_in(data)
+                if not keywords <= found:
+                    continue
+
+            match = cregexp(data)
+            if match is not None:
+                yield match, events[regexp]
+
+
+def install_event_prefilter(registry):
+    """Makes the bot's registry skip event regexes which can't match."""
+    if not isinstance(
+        getattr(registry.get_event_matches, "__self__", None), EventPrefilter
+    ):
+        registry.get_event_matches = EventPrefilter(registry).get_event_matches
@@ -0,0 +1,171 @@
+#  This file is part of cappuccino.
+#
+#  cappuccino is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  cappuccino is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with cappuccino.  If not, see <https://www.gnu.org/licenses/>.
+
+import asyncio
+import contextlib
+import functools
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+
+_DEFAULT_MAX_WORKERS = min(32, (os.cpu_count() or 1) + 4)
+
+
+@dataclass(frozen=True)
+class QuotaStats:
+    limit: int
+    running: int
+    queued: int
+    waiting: int
+    completed: int
+    wait_time_total: float
+    wait_time_max: float
+
+    @property
+    def wait_time_avg(self) -> float:
+        return self.wait_time_total / self.completed if self.completed else 0.0
+
+
+@dataclass(frozen=True)
+class ExecutorStats:
+    max_workers: int
+    queue_depth: int
+    plugins: dict[str, QuotaStats] = field(default_factory=dict)
+
+
+class _Quota:
+    """Caps how many of the executor's threads a single plugin may occupy."""
+
+    def __init__(self, name: str, limit: int, executor: ThreadPoolExecutor):
+        self.name = name
+        self.limit = limit
+        self.running = 0
+        self.waiting = 0
+        # Submitted to the pool but not yet picked up by a thread.
+        self.queued = 0
+        self.completed = 0
+        self.wait_time_total = 0.0
+        self.wait_time_max = 0.0
+        self._executor = executor
+        self._semaphore = asyncio.Semaphore(limit)
+
+    def _started(self, duration: float):
+        self.queued -= 1
+        self.wait_time_total += duration
+        self.wait_time_max = max(self.wait_time_max, duration)
+
+    def _release(self, *, cancelled: bool):
+        if cancelled:
+            self.queued -= 1
+        self.running -= 1
+        self.completed += 1
+        self._semaphore.release()
+
+    async def run(self, func, /, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        queued_at = time.perf_counter()
+
+        self.waiting += 1
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self.waiting -= 1
+        self.running += 1
+
+        def call():
+            # Time spent in the shared pool's queue counts as waiting too.
+            started_at = time.perf_counter()
+            loop.call_soon_threadsafe(self._started, started_at - queued_at)
+            return func(*args, **kwargs)
+
+        def done(future):
+            # The loop may already be gone if we're shutting down.
+            with contextlib.suppress(RuntimeError):
+                loop.call_soon_threadsafe(
+                    functools.partial(self._release, cancelled=future.cancelled())
+                )
+
+        try:
+            future = self._executor.submit(call)
+        except BaseException:
+            self.running -= 1
+            self._semaphore.release()
+            raise
+        self.queued += 1
+
+        # Keep the slot until the thread actually finishes, even if the caller
+        # is cancelled, otherwise the cap means nothing.
+        future.add_done_callback(done)
+        return await asyncio.wrap_future(future)
+
+    def stats(self) -> QuotaStats:
+        return QuotaStats(
+            limit=self.limit,
+            running=self.running - self.queued,
+            queued=self.queued,
+            waiting=self.waiting,
+            completed=self.completed,
+            wait_time_total=self.wait_time_total,
+            wait_time_max=self.wait_time_max,
+        )
+
+
+class BlockingExecutor:
+    """A thread pool for blocking plugin work, shared by every plugin.
+
+    Each plugin gets its own quota of threads (plugin_max_workers) so that one
+    plugin can't starve the others, and none of it touches the loop's default
+    executor, which asyncio needs for DNS lookups.
+    """
+
+    def __init__(self, executor_config: dict):
+        self.max_workers = max(
+            1, int(executor_config.get("max_workers", _DEFAULT_MAX_WORKERS))
+        )
+        self.plugin_max_workers = int(
+            executor_config.get("plugin_max_workers", max(1, self.max_workers // 2))
+        )
+        self._executor = ThreadPoolExecutor(
+            max_workers=self.max_workers, thread_name_prefix="cappuccino-blocking"
+        )
+        self._quotas: dict[str, _Quota] = {}
+
+    def quota(self, name: str, limit: int | None = None) -> _Quota:
+        if name not in self._quotas:
+            limit = min(limit or self.plugin_max_workers, self.max_workers)
+            self._quotas[name] = _Quota(name, limit, self._executor)
+        return self._quotas[name]
+
+    def stats(self) -> ExecutorStats:
+        return ExecutorStats(
+            max_workers=self.max_workers,
+            queue_depth=sum(quota.queued for quota in self._quotas.values()),
+            plugins={name: quota.stats() for name, quota in self._quotas.items()},
+        )
+
+
+_executor: BlockingExecutor | None = None
+_executor_lock = threading.Lock()
+
+
+def get_executor(executor_config: dict) -> BlockingExecutor:
+    """Returns the bot-wide BlockingExecutor, creating it on first use."""
+    global _executor  # noqa: PLW0603
+    with _executor_lock:
+        if _executor is None:
+            _executor = BlockingExecutor(executor_config)
+        return _executor
@@ -0,0 +1,159 @@
+#  This file is part of cappuccino.
+#
+#  cappuccino is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  cappuccino is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with cappuccino.  If not, see <https://www.gnu.org/licenses/>.
+
+import asyncio
+import atexit
+import time
+from secrets import randbelow
+
+import httpx
+
+from cappuccino.util import meta
+from cappuccino.util.metrics import HTTP_REQUEST_DURATION, HTTP_REQUESTS, current_plugin
+
+_DEFAULT_TIMEOUT = 5
+_DEFAULT_MAX_CONNECTIONS = 100
+_DEFAULT_MAX_CONNECTIONS_PER_HOST = 6
+_DEFAULT_KEEPALIVE_EXPIRY = 30
+
+_client: httpx.AsyncClient | None = None
+
+
+class _ReleasingStream(httpx.AsyncByteStream):
+    """Response stream that releases a per-host slot once the body is closed."""
+
+    def __init__(self, stream: httpx.AsyncByteStream, release):
+        self._stream = stream
+        self._release = release
+
+    async def __aiter__(self):
+        async for chunk in self._stream:
+            yield chunk
+
+    async def aclose(self):
+        try:
+            await self._stream.aclose()
+        finally:
+            release, self._release = self._release, None
+            if release is not None:
+                release()
+
+
+class _HostLimitedTransport(httpx.AsyncHTTPTransport):
+    """Transport which caps the number of in-flight requests to each host."""
+
+    def __init__(self, *, max_connections_per_host: int, **kwargs):
+        super().__init__(**kwargs)
+        self._max_connections_per_host = max_connections_per_host
+        self._semaphores: dict[str, asyncio.Semaphore] = {}
+        self._in_flight: dict[str, int] = {}
+
+    def _release(self, host: str):
+        self._semaphores[host].release()
+        self._in_flight[host] -= 1
+        # Don't keep a semaphore around for every host ever visited.
+        if not self._in_flight[host]:
+            del self._in_flight[host], self._semaphores[host]
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        host = request.url.host
+        if host not in self._semaphores:
+            self._semaphores[host] = asyncio.Semaphore(self._max_connections_per_host)
+            self._in_flight[host] = 0
+
+        semaphore = self._semaphores[host]
+        self._in_flight[host] += 1
+        try:
+            await semaphore.acquire()
+        except BaseException:
+            self._in_flight[host] -= 1
+            raise
+
+        labels = {"plugin": current_plugin.get(), "method": request.method}
+        start = time.perf_counter()
+        try:
+            response = await super().handle_async_request(request)
+        except BaseException:
+            self._release(host)
+            HTTP_REQUESTS.inc(**labels, status="error")
+            raise
+        finally:
+            HTTP_REQUEST_DURATION.observe(time.perf_counter() - start, **labels)
+
+        HTTP_REQUESTS.inc(**labels, status=response.status_code)
+
+        response.stream = _ReleasingStream(response.stream, lambda: self._release(host))
+        return response
+
+
+def _create_client(http_config: dict) -> httpx.AsyncClient:
+    # Accept YouTube consent cookies automatically
+    cookies = httpx.Cookies()
+    cookies.set("CONSENT", f"YES+srp.gws-20210512-0-RC3.en+FX+{1 + randbelow(1000)}")
+
+    limits = httpx.Limits(
+        max_connections=int(
+            http_config.get("max_connections", _DEFAULT_MAX_CONNECTIONS)
+        ),
+        max_keepalive_connections=int(
+            http_config.get("max_keepalive_connections", _DEFAULT_MAX_CONNECTIONS)
+        ),
+        keepalive_expiry=float(
+            http_config.get("keepalive_expiry", _DEFAULT_KEEPALIVE_EXPIRY)
+        ),
+    )
+    transport = _HostLimitedTransport(
+        http2=True,
+        limits=limits,
+        max_connections_per_host=int(
+            http_config.get(
+                "max_connections_per_host", _DEFAULT_MAX_CONNECTIONS_PER_HOST
+            )
+        ),
+    )
+
+    return httpx.AsyncClient(
+        transport=transport,
+        cookies=cookies,
+        headers={
+            "User-Agent": f"cappuccino {meta.VERSION} - {meta.SOURCE}",
+            "Accept-Language": "en-GB,en-US,en;q=0.5",
+        },
+        timeout=float(http_config.get("timeout", _DEFAULT_TIMEOUT)),
+        follow_redirects=True,
+    )
+
+
+def _close_client(loop: asyncio.AbstractEventLoop):
+    global _client
+    client, _client = _client, None
+    if client is None or client.is_closed or loop.is_closed() or loop.is_running():
+        return
+    loop.run_until_complete(client.aclose())
+
+
+def get_http_client(
+    http_config: dict, loop: asyncio.AbstractEventLoop
+) -> httpx.AsyncClient:
+    """Returns the bot-wide HTTP client, creating it on first use.
+
+    It's closed at exit, once loop has stopped. Anything a SIGINT handler
+    schedules on the loop would never run, as it stops straight after them.
+    """
+    global _client  # noqa: PLW0603
+    if _client is None or _client.is_closed:
+        _client = _create_client(http_config)
+        atexit.register(_close_client, loop)
+    return _client
@@ -0,0 +1,154 @@
+#  This file is part of cappuccino.
+#
+#  cappuccino is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  cappuccino is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with cappuccino.  If not, see <https://www.gnu.org/licenses/>.
+
+import json
+from collections import deque
+from typing import TYPE_CHECKING
+
+import markovify
+from markovify.chain import BEGIN, END
+
+if TYPE_CHECKING:
+    from collections.abc import Iterable
+    from pathlib import Path
+
+
+class _Chain(markovify.Chain):
+    """A markovify.Chain which runs can be added to and removed from."""
+
+    def __init__(self, state_size: int):
+        self._begin_changed = True
+        super().__init__([], state_size)
+
+    def precompute_begin_state(self):
+        # Every run changes the begin state, so put this off until it's needed.
+        self._begin_changed = True
+
+    def update(self, run: list[str], weight: int):
+        """Adds weight, which may be negative, to each of run's transitions."""
+        items = [BEGIN] * self.state_size + run + [END]
+        for i in range(len(run) + 1):
+            state = tuple(items[i : i + self.state_size])
+            follow = items[i + self.state_size]
+            follows = self.model.setdefault(state, {})
+            count = follows.get(follow, 0) + weight
+            if count > 0:
+                follows[follow] = count
+                continue
+
+            follows.pop(follow, None)
+            if not follows:
+                del self.model[state]
+        self._begin_changed = True
+
+    def move(self, state):
+        if self._begin_changed:
+            super().precompute_begin_state()
+            self._begin_changed = False
+        return super().move(state)
+
+
+class OnlineText(markovify.NewlineText):
+    """A NewlineText which keeps learning lines, and forgets the oldest ones.
+
+    Only the last max_lines lines are part of the model, so it stays about the
+    same size however long it's been running.
+    """
+
+    def __init__(self, max_lines: int, lines: Iterable[str] = (), state_size: int = 2):
+        super().__init__(
+            None,
+            state_size=state_size,
+            chain=_Chain(state_size),
+            retain_original=False,
+        )
+        self.max_lines = max_lines
+        # Kept to forget them again, they're split up again when they are.
+        self._lines: deque[str] = deque()
+        for line in lines:
+            self.add_line(line)
+
+    def __len__(self):
+        return len(self._lines)
+
+    def add_line(self, line: str):
+        runs = list(self.generate_corpus(line))
+        if not runs:
+            return
+
+        for run in runs:
+            self.chain.update(run, 1)
+        self._lines.append(line)
+
+        while len(self._lines) > self.max_lines:
+            for run in self.generate_corpus(self._lines.popleft()):
+                self.chain.update(run, -1)
+
+    def make_short_sentence(self, max_chars: int, min_chars: int = 0, **kwargs):
+        if not self._lines:
+            return None
+        return super().make_short_sentence(max_chars, min_chars, **kwargs)
+
+    def to_dict(self) -> dict:
+        return {
+            "state_size": self.state_size,
+            "max_lines": self.max_lines,
+            "lines": list(self._lines),
+            "chain": list(self.chain.model.items()),
+        }
+
+    @classmethod
+    def from_dict(cls, obj: dict, **_) -> OnlineText:
+        """Loads a model saved with to_dict(), without learning its lines again."""
+        model = cls(obj["max_lines"], state_size=obj["state_size"])
+        model.chain.model = {tuple(state): follows for state, follows in obj["chain"]}
+        model.chain.precompute_begin_state()
+        model._lines.extend(obj["lines"])
+        return model
+
+
+def save_text_model(model: OnlineText, path: Path, version: int):
+    """Saves model along with the version of the corpus it was built from."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    temporary_path = path.with_name(f".{path.name}.tmp")
+    temporary_path.write_text(
+        json.dumps({"version": version, "model": model.to_dict()}), encoding="UTF-8"
+    )
+    # Never leave a half-written model where the next start would load it.
+    temporary_path.replace(path)
+
+
+def load_text_model(path: Path) -> tuple[OnlineText, int]:
+    """Loads a model saved with save_text_model(), and its corpus version."""
+    saved = json.loads(path.read_text(encoding="UTF-8"))
+    return OnlineText.from_dict(saved["model"]), saved["version"]
+
+
+def build_text_model(
+    lines: list[str], max_lines: int, path: Path | None, version: int
+) -> tuple[OnlineText, OSError | None]:
+    """Builds a model and saves it to path, for running in a worker process.
+
+    Returns the model, and the error if it couldn't be saved.
+    """
+    model = OnlineText(max_lines, lines)
+    if path is None:
+        return model, None
+
+    try:
+        save_text_model(model, path, version)
+    except OSError as exc:
+        return model, exc
+    return model, None
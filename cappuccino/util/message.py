@@ -0,0 +1,163 @@
+#  This file is part of cappuccino.
+#
+#  cappuccino is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  cappuccino is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with cappuccino.  If not, see <https://www.gnu.org/licenses/>.
+
+import functools
+import inspect
+import re
+from functools import cached_property
+
+import irc3
+
+from cappuccino.util.formatting import unstyle
+
+_URL = re.compile(r"https?://\S+", re.IGNORECASE | re.UNICODE)
+_TRIGGER = re.compile(r"\?([A-Za-z0-9]+)")
+_SED = re.compile(r"^\s*s[/|\\!\.,\\].+")
+# Commands for us or any other bot in the channel.
+_ANY_COMMAND = re.compile(r"^\s*([.!~`$])+")
+
+
+def clean_url(url: str) -> str:
+    if url:
+        url = url.rstrip("'.,\"\1")
+        braces = [("{", "}"), ("<", ">"), ("[", "]"), ("(", ")")]
+        for left_brace, right_brace in braces:
+            if left_brace not in url and url.endswith(right_brace):
+                url = url.rstrip(right_brace)
+    return url
+
+
+class Message:
+    """A PRIVMSG or NOTICE, parsed on demand and shared by every plugin handling it.
+
+    Nothing is worked out until something asks for it, and then only once.
+    """
+
+    def __init__(self, mask, event: str, target, data: str, cmd_char: str):
+        self.mask = mask
+        self.event = event
+        self.target = target
+        # The message exactly as it was received.
+        self.data = data
+        self._cmd_char = cmd_char
+
+    def __repr__(self):
+        return f"<Message {self.event} {self.mask} -> {self.target}: {self.data!r}>"
+
+    @property
+    def is_notice(self) -> bool:
+        return self.event == "NOTICE"
+
+    @cached_property
+    def is_action(self) -> bool:
+        return self.data.startswith("\x01ACTION ")
+
+    @cached_property
+    def ctcp(self) -> str | None:
+        """The CTCP command, like "VERSION", or None if this isn't a CTCP request.
+
+        ACTIONs are only reported by is_action.
+        """
+        if not self.data.startswith("\x01") or self.is_action:
+            return None
+        words = self.data.strip("\x01").split(maxsplit=1)
+        return words[0].upper() if words else None
+
+    @cached_property
+    def text(self) -> str:
+        """The message with any ACTION/CTCP framing removed."""
+        return self.data.replace("\x01ACTION ", "").replace("\x01", "")
+
+    @cached_property
+    def stripped(self) -> str:
+        return self.text.strip()
+
+    @cached_property
+    def unstyled(self) -> str:
+        return unstyle(self.stripped)
+
+    @cached_property
+    def lower(self) -> str:
+        return self.stripped.lower()
+
+    @cached_property
+    def is_command(self) -> bool:
+        """Whether this is one of our commands."""
+        return self.data.startswith(self._cmd_char)
+
+    @cached_property
+    def looks_like_command(self) -> bool:
+        """Whether this looks like a command for any bot, including us."""
+        return _ANY_COMMAND.match(self.data) is not None
+
+    @cached_property
+    def is_sed(self) -> bool:
+        return _SED.match(self.data) is not None
+
+    @cached_property
+    def urls(self) -> list[str]:
+        """Every distinct URL, cleaned up and in the order they were sent."""
+        return list(dict.fromkeys(clean_url(url) for url in _URL.findall(self.data)))
+
+    @cached_property
+    def triggers(self) -> list[str]:
+        """Every ?trigger name, in the order they were sent."""
+        return _TRIGGER.findall(self.data)
+
+    def mentions(self, nick: str) -> bool:
+        return nick.lower() in self.lower
+
+
+@functools.lru_cache(maxsize=32)
+def parse_message(mask, event: str, target, data: str, cmd_char: str) -> Message:
+    """Returns the Message for a line, the same one for every handler that asks."""
+    return Message(mask, event, target, data, cmd_char)
+
+
+def _message_handler(func):
+    # irc3 passes the regex groups, which don't include the mask for our own
+    # messages and sometimes include IRCv3 tags.
+    if inspect.iscoroutinefunction(func):
+
+        @functools.wraps(func)
+        async def handler(self, mask=None, event=None, target=None, data=None, **_):
+            message = parse_message(mask, event, target, data, self.bot.config.cmd)
+            return await func(self, message)
+
+    else:
+
+        @functools.wraps(func)
+        def handler(self, mask=None, event=None, target=None, data=None, **_):
+            message = parse_message(mask, event, target, data, self.bot.config.cmd)
+            return func(self, message)
+
+    handler.handles_messages = True
+    return handler
+
+
+def message_event(*, iotype: str = "in"):
+    """Like @irc3.event(irc3.rfc.PRIVMSG), but the handler is called with a Message.
+
+    Handlers take (self, message) and share one Message per line, so nothing is
+    parsed more than once however many plugins look at it.
+    """
+
+    def decorator(func):
+        # Stacked for several iotypes, the function has been wrapped already.
+        if not getattr(func, "handles_messages", False):
+            func = _message_handler(func)
+        return irc3.event(irc3.rfc.PRIVMSG, iotype=iotype)(func)
+
+    return decorator
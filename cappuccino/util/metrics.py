@@ -0,0 +1,371 @@
+#  This file is part of cappuccino.
+#
+#  cappuccino is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  cappuccino is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with cappuccino.  If not, see <https://www.gnu.org/licenses/>.
+
+"""A minimal Prometheus metrics registry and the metrics cappuccino records.
+
+Everything here is cheap enough to call from the event loop, and safe to call
+from the worker threads blocking plugin work runs in.
+"""
+
+import asyncio
+import contextvars
+import functools
+import inspect
+import threading
+import time
+from abc import ABC, abstractmethod
+from bisect import bisect_left
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from collections.abc import Callable
+    from types import CodeType, FrameType
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+_DEFAULT_BUCKETS = (
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+
+# The plugin whose handler is currently running, so that DB queries and HTTP
+# requests can be attributed to it. Tasks inherit it from whoever created them.
+current_plugin: contextvars.ContextVar[str] = contextvars.ContextVar(
+    "current_plugin", default=""
+)
+
+# Maps the code of every instrumented handler to its (plugin, handler) labels,
+# which lets a stack captured from another thread be traced back to a handler.
+_handler_codes: dict[CodeType, tuple[str, str]] = {}
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", r"\\").replace("\n", r"\n").replace('"', r"\"")
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value))
+
+
+def _format_labels(labels: dict) -> str:
+    if not labels:
+        return ""
+    pairs = ",".join(f'{name}="{_escape(value)}"' for name, value in labels.items())
+    return f"{{{pairs}}}"
+
+
+class _Metric(ABC):
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self._values: dict[tuple, object] = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    @abstractmethod
+    def _samples(self):
+        """Yields the (name, labels, value) of each sample to render."""
+
+    def render(self) -> str:
+        lines = [
+            f"# HELP {self.name} {_escape(self.documentation)}",
+            f"# TYPE {self.name} {self.kind}",
+        ]
+        lines.extend(
+            f"{name}{_format_labels(labels)} {_format_value(value)}"
+            for name, labels, value in self._samples()
+        )
+        return "\n".join(lines)
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def collect(self) -> list[tuple[dict[str, str], float]]:
+        """Returns the current value for every combination of labels seen so far."""
+        with self._lock:
+            values = list(self._values.items())
+        return [
+            (dict(zip(self.labelnames, key, strict=True)), value)
+            for key, value in values
+        ]
+
+    def _samples(self):
+        for labels, value in self.collect():
+            yield f"{self.name}_total", labels, value
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def set(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def _samples(self):
+        with self._lock:
+            values = list(self._values.items())
+        for key, value in values:
+            yield self.name, dict(zip(self.labelnames, key, strict=True)), value
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: tuple[str, ...] = (),
+        buckets: tuple[float, ...] = _DEFAULT_BUCKETS,
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = (*sorted(buckets), float("inf"))
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            if key not in self._values:
+                # Per-bucket (not cumulative) counts, then the sum.
+                self._values[key] = [[0] * len(self.buckets), 0.0]
+            counts, _ = state = self._values[key]
+            counts[bisect_left(self.buckets, value)] += 1
+            state[1] += value
+
+    def _samples(self):
+        with self._lock:
+            values = [
+                (key, list(counts), total)
+                for key, (counts, total) in self._values.items()
+            ]
+        for key, counts, total in values:
+            labels = dict(zip(self.labelnames, key, strict=True))
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts, strict=True):
+                cumulative += count
+                yield (
+                    f"{self.name}_bucket",
+                    {**labels, "le": _format_value(bound)},
+                    cumulative,
+                )
+            yield f"{self.name}_sum", labels, total
+            yield f"{self.name}_count", labels, cumulative
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: list[_Metric] = []
+        self._collectors: dict[str, Callable[[], None]] = {}
+
+    def register(self, metric: _Metric):
+        self._metrics.append(metric)
+        return metric
+
+    def set_collector(self, name: str, collector: Callable[[], None]):
+        """Registers a callable which updates gauges just before each scrape.
+
+        Setting a collector under an existing name replaces it.
+        """
+        self._collectors[name] = collector
+
+    def render(self) -> str:
+        for collector in self._collectors.values():
+            collector()
+        return "\n".join(metric.render() for metric in self._metrics) + "\n"
+
+
+REGISTRY = Registry()
+
+HANDLER_CALLS = REGISTRY.register(
+    Counter(
+        "cappuccino_handler_calls",
+        "Event handler and command invocations.",
+        ("plugin", "handler", "kind"),
+    )
+)
+HANDLER_ERRORS = REGISTRY.register(
+    Counter(
+        "cappuccino_handler_errors",
+        "Event handler and command invocations which raised an exception.",
+        ("plugin", "handler", "kind"),
+    )
+)
+HANDLER_DURATION = REGISTRY.register(
+    Histogram(
+        "cappuccino_handler_duration_seconds",
+        "Time spent in event handlers and commands, including awaits.",
+        ("plugin", "handler", "kind"),
+    )
+)
+DB_QUERIES = REGISTRY.register(
+    Counter(
+        "cappuccino_db_queries",
+        "Database queries executed.",
+        ("plugin", "engine", "statement"),
+    )
+)
+DB_QUERY_DURATION = REGISTRY.register(
+    Histogram(
+        "cappuccino_db_query_duration_seconds",
+        "Time spent executing database queries.",
+        ("plugin", "engine"),
+    )
+)
+CACHE_REQUESTS = REGISTRY.register(
+    Counter(
+        "cappuccino_cache_requests",
+        "In-process cache lookups, by whether they were a hit or a miss.",
+        ("cache", "result"),
+    )
+)
+HTTP_REQUESTS = REGISTRY.register(
+    Counter(
+        "cappuccino_http_requests",
+        "Outbound HTTP requests, status is 'error' if no response was received.",
+        ("plugin", "method", "status"),
+    )
+)
+HTTP_REQUEST_DURATION = REGISTRY.register(
+    Histogram(
+        "cappuccino_http_request_duration_seconds",
+        "Time until outbound HTTP requests received response headers.",
+        ("plugin", "method"),
+    )
+)
+
+
+def _instrument_coroutine(callback, plugin: str, record):
+    @functools.wraps(callback)
+    async def wrapper(*args, **kwargs):
+        token = current_plugin.set(plugin)
+        start = time.perf_counter()
+        failed = False
+        try:
+            return await callback(*args, **kwargs)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            failed = True
+            raise
+        finally:
+            record(time.perf_counter() - start, failed=failed)
+            current_plugin.reset(token)
+
+    return wrapper
+
+
+def _instrument_generator(generator, plugin: str, record, duration: float):
+    """Times each reply as it's asked for, and records the total once it's done."""
+    failed = False
+    try:
+        while True:
+            token = current_plugin.set(plugin)
+            start = time.perf_counter()
+            try:
+                item = next(generator)
+            except StopIteration:
+                return
+            finally:
+                duration += time.perf_counter() - start
+                current_plugin.reset(token)
+            yield item
+    except Exception:
+        failed = True
+        raise
+    finally:
+        generator.close()
+        record(duration, failed=failed)
+
+
+def _instrument_function(callback, plugin: str, record):
+    @functools.wraps(callback)
+    def wrapper(*args, **kwargs):
+        token = current_plugin.set(plugin)
+        start = time.perf_counter()
+        try:
+            result = callback(*args, **kwargs)
+        except Exception:
+            record(time.perf_counter() - start, failed=True)
+            raise
+        finally:
+            current_plugin.reset(token)
+
+        duration = time.perf_counter() - start
+        if inspect.isgenerator(result):
+            return _instrument_generator(result, plugin, record, duration)
+        record(duration, failed=False)
+        return result
+
+    return wrapper
+
+
+def instrument(callback, plugin: str, handler: str, kind: str):
+    """Wraps a plugin event handler or command to record calls, errors and latency.
+
+    Generator commands are wrapped in a generator which counts the time spent
+    producing each reply, without asking for any sooner than irc3 does.
+    """
+
+    labels = {"plugin": plugin, "handler": handler, "kind": kind}
+    # Decorated handlers run the original function, so that's what a stack has.
+    if code := getattr(inspect.unwrap(callback), "__code__", None):
+        _handler_codes[code] = (plugin, handler)
+
+    def record(duration: float, *, failed: bool):
+        HANDLER_CALLS.inc(**labels)
+        HANDLER_DURATION.observe(duration, **labels)
+        if failed:
+            HANDLER_ERRORS.inc(**labels)
+
+    if inspect.iscoroutinefunction(callback):
+        wrapper = _instrument_coroutine(callback, plugin, record)
+    else:
+        wrapper = _instrument_function(callback, plugin, record)
+
+    wrapper.instrumented = True
+    return wrapper
+
+
+def find_handler(frame: FrameType | None) -> tuple[str, str] | None:
+    """Returns the (plugin, handler) of the innermost instrumented handler in a stack."""
+    while frame is not None:
+        if labels := _handler_codes.get(frame.f_code):
+            return labels
+        frame = frame.f_back
+    return None
@@ -0,0 +1,109 @@
+#  This file is part of cappuccino.
+#
+#  cappuccino is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  cappuccino is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with cappuccino.  If not, see <https://www.gnu.org/licenses/>.
+
+import asyncio
+import sys
+import threading
+import time
+import traceback
+
+import irc3
+
+from cappuccino import Plugin
+from cappuccino.util.metrics import REGISTRY, Counter, Histogram, find_handler
+
+_LOOP_LAG = REGISTRY.register(
+    Histogram(
+        "cappuccino_loop_lag_seconds",
+        "How late the event loop was to wake the watchdog's heartbeat.",
+    )
+)
+_LOOP_STALLS = REGISTRY.register(
+    Counter(
+        "cappuccino_loop_stalls",
+        "Times the event loop was blocked for longer than the stall threshold,"
+        " by the handler that was running.",
+        ("plugin", "handler"),
+    )
+)
+
+
+@irc3.plugin
+class Watchdog(Plugin):
+    """Measures event loop lag and reports what was running whenever it stalls."""
+
+    requires = ["cappuccino.metrics"]
+
+    def __init__(self, bot):
+        super().__init__(bot)
+        self._interval = float(self.config.get("interval", 0.25))
+        self._threshold = float(self.config.get("threshold", 1))
+        self._stack_limit = int(self.config.get("stack_limit", 30))
+
+        # Written by the loop, read by the watchdog thread.
+        self._last_beat = time.monotonic()
+        self._beats = 0
+        self._loop_thread_id: int | None = None
+
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(
+            target=self._watch, name="cappuccino-watchdog", daemon=True
+        )
+        self.bot.create_task(self._heartbeat())
+
+    def SIGINT(self):  # noqa: N802
+        self._stopped.set()
+
+    async def _heartbeat(self):
+        self._loop_thread_id = threading.get_ident()
+        self._thread.start()
+        self.logger.info(
+            f"Watching for event loop stalls longer than {self._threshold} seconds."
+        )
+
+        loop = asyncio.get_running_loop()
+        while not self._stopped.is_set():
+            start = loop.time()
+            await asyncio.sleep(self._interval)
+            _LOOP_LAG.observe(max(0.0, loop.time() - start - self._interval))
+            self._last_beat = time.monotonic()
+            self._beats += 1
+
+    def _watch(self):
+        reported_beat = None
+        # Check often enough to catch the loop while it's still stuck.
+        while not self._stopped.wait(min(self._interval, self._threshold / 2)):
+            beat = self._beats
+            stalled_for = time.monotonic() - self._last_beat - self._interval
+            if stalled_for < self._threshold or beat == reported_beat:
+                continue
+
+            # Only report each stall once, however long it lasts.
+            reported_beat = beat
+            self._report_stall(stalled_for)
+
+    def _report_stall(self, stalled_for: float):
+        frame = sys._current_frames().get(self._loop_thread_id)  # noqa: SLF001
+        if frame is None:
+            return
+
+        plugin, handler = find_handler(frame) or ("", "")
+        _LOOP_STALLS.inc(plugin=plugin, handler=handler)
+
+        running = f"{plugin}.{handler}" if handler else "no known handler"
+        stack = "".join(traceback.format_stack(frame, limit=self._stack_limit))
+        self.logger.warning(
+            f"Event loop blocked for {stalled_for:.2f}+ seconds in {running}:\n{stack}"
+        )
@@ -0,0 +1,49 @@
+#  This file is part of cappuccino.
+#
+#  cappuccino is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  cappuccino is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with cappuccino.  If not, see <https://www.gnu.org/licenses/>.
+
+import unittest
+
+from sqlalchemy import exc
+
+from cappuccino.util.database import Database
+
+
+class AsyncSessionLimitTest(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        # Beginning a session doesn't connect, so there needn't be a server.
+        self.database = Database(
+            {
+                "uri": "postgresql+psycopg://localhost/cappuccino",
+                "plugin_max_connections": 1,
+                "pool_timeout": 0.1,
+            }
+        )
+        self.session_factory = self.database.async_session_factory("test")
+
+    def checked_out(self) -> int:
+        return self.database.stats()["async"].plugins["test"]
+
+    async def test_begin_takes_a_slot(self):
+        async with self.session_factory.begin():
+            assert self.checked_out() == 1
+            with self.assertRaises(exc.TimeoutError):
+                async with self.session_factory.begin():
+                    pass
+        assert self.checked_out() == 0
+
+    async def test_begin_in_session_takes_one_slot(self):
+        async with self.session_factory() as session, session.begin():
+            assert self.checked_out() == 1
+        assert self.checked_out() == 0
@@ -0,0 +1,37 @@
+#  This file is part of cappuccino.
+#
+#  cappuccino is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  cappuccino is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with cappuccino.  If not, see <https://www.gnu.org/licenses/>.
+
+import re
+import unittest
+
+from cappuccino.util.dispatch import required_keywords
+
+
+class RequiredKeywordsTest(unittest.TestCase):
+    def assert_keywords_found(self, pattern: str, line: str):
+        compiled = re.compile(pattern)
+        assert compiled.search(line) is not None
+        for keyword in required_keywords(compiled):
+            assert keyword in line.lower(), keyword
+
+    def test_literals(self):
+        pattern = re.compile(r"^:\S+ PRIVMSG (?P<target>\S+) :wew+")
+        assert required_keywords(pattern) == {"privmsg", ":wew"}
+
+    def test_ignorecase_folding(self):
+        self.assert_keywords_found(r"(?i)same", "\u017fame")
+        self.assert_keywords_found(r"(?i)\bit\b", "\u0130t")
+        self.assert_keywords_found(r"(?i:ms) PRIVMSG", "m\u017f PRIVMSG")
+        self.assert_keywords_found(r"\u039f\u03a3 ", "\u039f\u03a3 ")
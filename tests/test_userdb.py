@@ -0,0 +1,40 @@
+#  This file is part of cappuccino.
+#
+#  cappuccino is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  cappuccino is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with cappuccino.  If not, see <https://www.gnu.org/licenses/>.
+
+"""Run with: python -W error::sqlalchemy.exc.SAWarning -m unittest"""
+
+import unittest
+import warnings
+
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.exc import SAWarning
+from sqlalchemy.sql.compiler import FROM_LINTING
+
+from cappuccino.userdb import _append_entries, _delete_entries, _replace_entry
+
+
+class ListStatementTest(unittest.TestCase):
+    def assert_compiles_cleanly(self, statement):
+        with warnings.catch_warnings(action="error", category=SAWarning):
+            statement.compile(dialect=postgresql.dialect(), linting=FROM_LINTING)
+
+    def test_append_entries(self):
+        self.assert_compiles_cleanly(_append_entries("nick", "dtops", ["a"], 6))
+
+    def test_delete_entries(self):
+        self.assert_compiles_cleanly(_delete_entries("nick", "dtops", [0, -1]))
+
+    def test_replace_entry(self):
+        self.assert_compiles_cleanly(_replace_entry("nick", "dtops", -1, "a"))